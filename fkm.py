@@ -1,919 +1,3532 @@
 #!/usr/bin/env python3
-import gi
-gi.require_version('Gtk', '3.0')
-# Note: Notify is not imported as desktop notifications are replaced by in-app indicators.
-# If you still see Notify warnings, ensure your local file matches this Canvas.
-from gi.repository import Gtk, Gdk, GLib
+try:
+    from gi.repository import GLib, Gio # Main loop and D-Bus; Gtk is only imported by run_gui()
+except ImportError:
+    GLib = Gio = None # The collector, fleet and verify modes only need the standard library
 import subprocess
 import os
+import sys
+import json
+import struct
+import gzip
+import lzma
+import bz2
+import shutil
+import mmap
+import stat
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import re
+import shlex
+import argparse
 import threading
+import time
 from pathlib import Path
 
-class KernelManager(Gtk.Window):
+try:
+    import zstandard # Optional: zstd initramfs images are otherwise piped through the zstd binary
+except ImportError:
+    zstandard = None
+
+# Per-user cache directory for data that is expensive to recompute (boot history, indexes...)
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "fkm"
+
+
+def load_json_cache(name, default=None):
+    """Loads a JSON cache file from CACHE_DIR, returning 'default' if missing or corrupt."""
+    try:
+        with open(CACHE_DIR / name, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} if default is None else default
+
+
+def save_json_cache(name, data):
+    """Writes a JSON cache file atomically (temp file + rename)."""
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = CACHE_DIR / f".{name}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, CACHE_DIR / name)
+    except OSError:
+        pass # A cache that cannot be written only costs time on the next run
+
+
+def print_table(columns, rows):
+    """Prints rows as a plain text table (used by the command-line modes)."""
+    rows = [["" if v is None else str(v) for v in row] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in rows]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip())
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+
+
+# --- Boot performance history (journal) ---
+# MESSAGE_ID of systemd's "Startup finished in ..." message (SD_MESSAGE_STARTUP_FINISHED)
+STARTUP_FINISHED_MESSAGE_ID = "b07a249cd024414a82dd00cd181378ff"
+BOOT_TIME_FIELDS = ["FIRMWARE_USEC", "LOADER_USEC", "KERNEL_USEC", "INITRD_USEC", "USERSPACE_USEC"]
+BOOT_HISTORY_FIELDS = ["_TRANSPORT", "_PID", "PRIORITY", "MESSAGE", "MESSAGE_ID"] + BOOT_TIME_FIELDS
+BOOT_HISTORY_CACHE = "boot-history.json"
+
+
+def _journal_value(value):
+    """Journal JSON encodes non-UTF-8 fields as byte arrays; normalise everything to str."""
+    if isinstance(value, list):
+        return bytes(value).decode("utf-8", "replace")
+    return value
+
+
+def iter_journal_export(fh):
+    """
+    Yields entries (dicts) from a binary stream in 'journalctl -o export' format,
+    or from 'journalctl -o json' output (one JSON object per line).
+    """
+    first = fh.peek(1)[:1] if hasattr(fh, "peek") else b""
+    if first == b"{":
+        for line in fh:
+            if line.strip():
+                entry = json.loads(line)
+                yield {k: _journal_value(v) for k, v in entry.items()}
+        return
+
+    entry = {}
+    while True:
+        line = fh.readline()
+        if not line:
+            break
+        if line == b"\n":
+            if entry:
+                yield entry
+            entry = {}
+            continue
+        line = line.rstrip(b"\n")
+        if b"=" in line:
+            key, _, value = line.partition(b"=")
+        else:
+            # Binary-safe field: name, 64-bit little endian length, data, newline
+            key = line
+            size = struct.unpack("<Q", fh.read(8))[0]
+            value = fh.read(size)
+            fh.read(1)
+        entry[key.decode("ascii", "replace")] = value.decode("utf-8", "replace")
+    if entry:
+        yield entry
+
+
+def _new_boot_record(boot_id):
+    return {"boot_id": boot_id, "first_usec": None, "kernel": None, "boot_usec": None,
+            "kernel_usec": None, "initrd_usec": None, "userspace_usec": None,
+            "errors": 0, "critical": 0}
+
+
+def _feed_boot_record(record, entry):
+    """Updates a boot record with one journal entry. Returns True if the entry was relevant."""
+    if record["first_usec"] is None and entry.get("__REALTIME_TIMESTAMP"):
+        record["first_usec"] = int(entry["__REALTIME_TIMESTAMP"])
+    transport = entry.get("_TRANSPORT")
+    if transport == "kernel":
+        message = entry.get("MESSAGE") or ""
+        if record["kernel"] is None and message.startswith("Linux version "):
+            record["kernel"] = message.split()[2]
+        priority = entry.get("PRIORITY")
+        if priority is not None and priority.isdigit() and int(priority) <= 3:
+            record["errors"] += 1
+            if int(priority) <= 2:
+                record["critical"] += 1
+        return True
+    if entry.get("MESSAGE_ID") == STARTUP_FINISHED_MESSAGE_ID and entry.get("_PID") == "1":
+        times = {f: int(entry[f]) for f in BOOT_TIME_FIELDS if entry.get(f, "").isdigit()}
+        if times:
+            record["boot_usec"] = sum(times.values())
+            record["kernel_usec"] = times.get("KERNEL_USEC")
+            record["initrd_usec"] = times.get("INITRD_USEC")
+            record["userspace_usec"] = times.get("USERSPACE_USEC")
+        return True
+    return False
+
+
+def list_journal_boots():
+    """Returns the boot IDs known to the journal, oldest first."""
+    result = subprocess.run(["journalctl", "--list-boots", "--no-pager", "-q"],
+                            capture_output=True, text=True, check=True)
+    boots = []
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # Columns: IDX BOOT_ID FIRST_ENTRY LAST_ENTRY (the header line is skipped by this check)
+        if len(parts) > 1 and len(parts[1]) == 32 and all(c in "0123456789abcdef" for c in parts[1]):
+            boots.append(parts[1])
+    return boots
+
+
+def scan_journal_boot(boot_id):
+    """
+    Builds the boot record for one boot by streaming only the matching journal entries:
+    kernel errors (PRIORITY 0-3), pid 1's "Startup finished" message and the kernel banner.
+    """
+    record = _new_boot_record(boot_id)
+    output_fields = "--output-fields=" + ",".join(BOOT_HISTORY_FIELDS)
+    # Same-field matches are OR-ed, different fields AND-ed and '+' separates alternatives
+    cmd = (["journalctl", "-b", boot_id, "-o", "export", "--no-pager", output_fields,
+            "_TRANSPORT=kernel", "PRIORITY=0", "PRIORITY=1", "PRIORITY=2", "PRIORITY=3",
+            "+", f"MESSAGE_ID={STARTUP_FINISHED_MESSAGE_ID}", "_PID=1"])
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        for entry in iter_journal_export(proc.stdout):
+            _feed_boot_record(record, entry)
+
+    # The "Linux version" banner is one of the very first kernel messages: stop reading once seen
+    cmd = ["journalctl", "-b", boot_id, "-k", "-o", "export", "--no-pager",
+           "--output-fields=MESSAGE,_TRANSPORT"]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        for count, entry in enumerate(iter_journal_export(proc.stdout)):
+            message = entry.get("MESSAGE") or ""
+            if message.startswith("Linux version "):
+                record["kernel"] = message.split()[2]
+                break
+            if count > 200:
+                break
+        proc.kill()
+    return record
+
+
+def read_boot_history_file(path):
+    """Builds boot records from a canned journal export (or JSON) file, for offline use."""
+    records = {}
+    with open(path, "rb") as fh:
+        for entry in iter_journal_export(fh):
+            boot_id = entry.get("_BOOT_ID")
+            if not boot_id:
+                continue
+            record = records.setdefault(boot_id, _new_boot_record(boot_id))
+            _feed_boot_record(record, entry)
+    return sorted(records.values(), key=lambda r: r["first_usec"] or 0)
+
+
+def collect_boot_history(journal_file=None, log=None):
+    """
+    Returns per-boot records (oldest first). Records of finished boots are cached in
+    CACHE_DIR, so only boots that are new since the last run are read from the journal.
+    """
+    if journal_file:
+        return read_boot_history_file(journal_file)
+
+    cache = load_json_cache(BOOT_HISTORY_CACHE)
+    try:
+        current_boot = Path("/proc/sys/kernel/random/boot_id").read_text().strip().replace("-", "")
+    except OSError:
+        current_boot = None
+
+    records = []
+    for boot_id in list_journal_boots():
+        record = cache.get(boot_id)
+        if record is None:
+            if log:
+                log(f"Scanning journal for boot {boot_id}...\n")
+            record = scan_journal_boot(boot_id)
+            if boot_id != current_boot: # The running boot is still being written, never cache it
+                cache[boot_id] = record
+        records.append(record)
+    save_json_cache(BOOT_HISTORY_CACHE, cache)
+    return records
+
+
+def summarize_boot_history(records):
+    """Aggregates boot records per kernel version for comparison."""
+    per_kernel = {}
+    for record in records:
+        kernel = record.get("kernel") or "unknown"
+        stats = per_kernel.setdefault(kernel, {"kernel": kernel, "boots": 0, "timed_boots": 0,
+                                               "total_usec": 0, "best_usec": None, "worst_usec": None,
+                                               "errors": 0, "last_usec": 0})
+        stats["boots"] += 1
+        stats["errors"] += record.get("errors") or 0
+        stats["last_usec"] = max(stats["last_usec"], record.get("first_usec") or 0)
+        boot_usec = record.get("boot_usec")
+        if boot_usec:
+            stats["timed_boots"] += 1
+            stats["total_usec"] += boot_usec
+            stats["best_usec"] = boot_usec if stats["best_usec"] is None else min(stats["best_usec"], boot_usec)
+            stats["worst_usec"] = boot_usec if stats["worst_usec"] is None else max(stats["worst_usec"], boot_usec)
+
+    summary = []
+    for stats in per_kernel.values():
+        summary.append({
+            "kernel": stats["kernel"],
+            "boots": stats["boots"],
+            "avg_boot_s": round(stats["total_usec"] / stats["timed_boots"] / 1e6, 2) if stats["timed_boots"] else None,
+            "best_boot_s": round(stats["best_usec"] / 1e6, 2) if stats["best_usec"] else None,
+            "worst_boot_s": round(stats["worst_usec"] / 1e6, 2) if stats["worst_usec"] else None,
+            "avg_errors": round(stats["errors"] / stats["boots"], 1),
+            "last_usec": stats["last_usec"],
+        })
+    return sorted(summary, key=lambda s: s["last_usec"], reverse=True)
+
+
+# --- In-process configuration files (dnf.conf, /etc/default/grub) ---
+DNF_CONF_PATH = "/etc/dnf/dnf.conf"
+GRUB_DEFAULTS_PATH = "/etc/default/grub"
+KERNEL_CMDLINE_PATH = "/etc/kernel/cmdline" # Command line kernel-install gives new kernels, if present
+BLS_ENTRIES_DIR = "/boot/loader/entries"
+CONFIG_LINE_RE = re.compile(r"^(\s*)([A-Za-z_][A-Za-z0-9_.-]*)(\s*=\s*)(.*?)(\s*)$")
+
+# Files the privileged '--apply-files' helper is allowed to replace
+PRIVILEGED_WRITE_PATHS = {DNF_CONF_PATH, GRUB_DEFAULTS_PATH, KERNEL_CMDLINE_PATH}
+
+
+class ConfigFile:
+    """
+    A key=value configuration file parsed in-process. 'section' selects an INI section
+    (dnf.conf keeps its options under [main]); 'shell' files (/etc/default/grub) use shell quoting.
+    Edits only touch the value of the edited line, so comments, order and spacing are preserved.
+    """
+    def __init__(self, path, section=None, shell=False):
+        self.path = path
+        self.section = section
+        self.shell = shell
+        self.lines = []
+        self.stat_key = None
+        self.dirty = False
+
+    def load(self):
+        """(Re)reads the file if it changed (inode/mtime/size) since the last read. Needs no privilege."""
+        try:
+            st = os.stat(self.path)
+            stat_key = [st.st_ino, st.st_mtime_ns, st.st_size]
+        except FileNotFoundError:
+            stat_key = None
+        if stat_key == self.stat_key and self.lines:
+            return self
+        if stat_key is None:
+            self.lines = []
+        else:
+            with open(self.path, "r") as f:
+                self.lines = f.read().splitlines()
+        self.stat_key = stat_key
+        self.dirty = False
+        return self
+
+    def discard(self):
+        """Drops pending in-memory edits by re-reading the file."""
+        self.stat_key = None
+        return self.load()
+
+    def _in_section(self):
+        """Yields (index, match) for key lines that belong to the configured section."""
+        current = None
+        for i, line in enumerate(self.lines):
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                current = stripped[1:-1].strip()
+                continue
+            if not stripped or stripped[0] in "#;":
+                continue
+            if self.section is not None and current != self.section:
+                continue
+            match = CONFIG_LINE_RE.match(line)
+            if match:
+                yield i, match
+
+    def _find(self, key):
+        found = None
+        for i, match in self._in_section():
+            if match.group(2) == key:
+                found = (i, match) # The last assignment wins, as in the shell and in dnf
+        return found
+
+    def _unquote(self, value):
+        if self.shell and len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            if value[0] == '"':
+                return re.sub(r'\\(["$`\\])', r"\1", value[1:-1])
+            return value[1:-1]
+        return value
+
+    def _quote(self, value, like=""):
+        if not self.shell:
+            return value
+        quote = like[:1] if like[:1] in ("\"", "'") else ""
+        if not quote and (not value or re.search(r"[\s\"'$`\\;&|<>()]", value)):
+            quote = '"'
+        if quote == '"':
+            value = re.sub(r'(["$`\\])', r"\\\1", value)
+        elif quote == "'":
+            value = value.replace("'", "'\\''")
+        return f"{quote}{value}{quote}"
+
+    def get(self, key, default=None):
+        found = self._find(key)
+        return self._unquote(found[1].group(4)) if found else default
+
+    def set(self, key, value):
+        """Sets 'key' in memory, editing the existing line or adding one. Returns True if changed."""
+        value = str(value)
+        if self.get(key) == value:
+            return False
+        found = self._find(key)
+        if found:
+            i, match = found
+            self.lines[i] = (match.group(1) + key + match.group(3) +
+                             self._quote(value, like=match.group(4)) + match.group(5))
+        else:
+            new_line = f"{key}={self._quote(value)}"
+            insert_at = len(self.lines)
+            if self.section is not None:
+                section_lines = [i for i, _ in self._in_section()]
+                if section_lines:
+                    insert_at = section_lines[-1] + 1
+                elif f"[{self.section}]" not in [l.strip() for l in self.lines]:
+                    self.lines.append(f"[{self.section}]")
+                    insert_at = len(self.lines)
+                else:
+                    insert_at = [l.strip() for l in self.lines].index(f"[{self.section}]") + 1
+            self.lines.insert(insert_at, new_line)
+        self.dirty = True
+        return True
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+_config_cache = {}
+
+
+def get_config(path):
+    """Returns the cached ConfigFile for 'path', reloaded only if the file changed on disk."""
+    config = _config_cache.get(path)
+    if config is None:
+        if path == DNF_CONF_PATH:
+            config = ConfigFile(path, section="main")
+        else:
+            config = ConfigFile(path, shell=path == GRUB_DEFAULTS_PATH)
+        _config_cache[path] = config
+    if not config.dirty:
+        config.load()
+    return config
+
+
+def is_privileged_write_path(path):
+    """Only the known configuration files and BLS boot entries may be written as root."""
+    if path in PRIVILEGED_WRITE_PATHS:
+        return True
+    return os.path.dirname(path) == BLS_ENTRIES_DIR and path.endswith(".conf")
+
+
+def apply_files(payload):
+    """
+    Replaces each file atomically: the new content is written to a temp file in the same
+    directory (keeping the old mode, owner and SELinux label), fsync'ed and renamed over the original.
+    'payload' is a list of {"path", "content", "expect"}; a file modified since it was read
+    ([inode, mtime_ns, size] differs from 'expect') is refused. Runs as root via '--apply-files'.
+    Every file is checked before the first one is written, and each directory is synced once.
+    """
+    for item in payload:
+        path = os.path.realpath(item["path"])
+        if not is_privileged_write_path(path):
+            raise ValueError(f"refusing to write {path}")
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        expected = item.get("expect")
+        if expected is not None and (st is None or [st.st_ino, st.st_mtime_ns, st.st_size] != expected):
+            raise ValueError(f"{path} changed on disk since it was read")
+
+    directories = set()
+    for item in payload:
+        path = os.path.realpath(item["path"])
+        directory = os.path.dirname(path)
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.fkm-tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                if os.path.exists(path):
+                    st = os.stat(path)
+                    os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                    os.fchown(f.fileno(), st.st_uid, st.st_gid)
+                    # A new inode gets the directory's type (etc_t), not e.g. bootloader_etc_t like sed -i kept
+                    try:
+                        os.setxattr(f.fileno(), "security.selinux", os.getxattr(path, "security.selinux"))
+                    except OSError:
+                        pass # No SELinux label to copy (SELinux disabled, or no xattr support)
+                f.write(item["content"])
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        directories.add(directory)
+
+    for directory in directories:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def privileged_apply_files_cmd():
+    """Command that runs the '--apply-files' helper as root; the payload is passed on stdin."""
+    return ["pkexec", sys.executable, os.path.abspath(__file__), "--apply-files"]
+
+
+def config_payload(configs):
+    """Builds the '--apply-files' payload for the edited ConfigFile objects."""
+    return json.dumps([{"path": c.path, "content": c.render(),
+                        "expect": c.stat_key}
+                       for c in configs if c.dirty])
+
+
+# --- Boot Loader Specification entries and kernel command lines ---
+def split_cmdline(cmdline):
+    """Splits a kernel command line on spaces, keeping double-quoted values (foo="a b") together."""
+    return re.findall(r'(?:[^\s"]+|"[^"]*")+', cmdline or "")
+
+
+def edit_cmdline(args, add=(), remove=()):
+    """
+    Returns a new argument list with the same semantics as 'grubby --args/--remove-args':
+    removing 'foo' drops 'foo' and any 'foo=...', removing 'foo=bar' drops only that exact
+    argument, and adding 'foo=bar' replaces an existing 'foo=...' in place.
+    """
+    result = list(args)
+    for arg in remove:
+        if "=" in arg:
+            result = [a for a in result if a != arg]
+        else:
+            result = [a for a in result if a != arg and not a.startswith(arg + "=")]
+    for arg in add:
+        key = arg.split("=", 1)[0]
+        positions = [i for i, a in enumerate(result) if a.split("=", 1)[0] == key]
+        if positions:
+            result[positions[0]] = arg
+            result = [a for i, a in enumerate(result) if i not in positions[1:]]
+        else:
+            result.append(arg)
+    return result
+
+
+class BootEntry:
+    """A BLS boot entry (/boot/loader/entries/*.conf): 'key value' lines, edited in place."""
+    def __init__(self, path, text, stat_key=None):
+        self.path = path
+        self.lines = text.splitlines()
+        self.stat_key = stat_key
+
+    def get(self, key, default=None):
+        for line in self.lines:
+            parts = line.strip().split(None, 1)
+            if parts and parts[0] == key:
+                return parts[1] if len(parts) > 1 else ""
+        return default
+
+    @property
+    def title(self):
+        return self.get("title", os.path.basename(self.path))
+
+    @property
+    def version(self):
+        return self.get("version")
+
+    @property
+    def uses_grubenv(self):
+        """Old Fedora entries take their options from $kernelopts in grubenv; those are not edited here."""
+        return "$kernelopts" in (self.get("options") or "")
+
+    @property
+    def args(self):
+        return split_cmdline(self.get("options"))
+
+    def set_args(self, args):
+        options = " ".join(args)
+        for i, line in enumerate(self.lines):
+            parts = line.strip().split(None, 1)
+            if parts and parts[0] == "options":
+                self.lines[i] = f"options {options}"
+                return
+        self.lines.append(f"options {options}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def read_boot_entry_files(directory=BLS_ENTRIES_DIR):
+    """Returns {path: {"text", "stat"}} for the BLS entries in 'directory'."""
+    files = {}
+    with os.scandir(directory) as it:
+        for dirent in it:
+            if dirent.name.endswith(".conf") and dirent.is_file():
+                with open(dirent.path, "r") as f:
+                    text = f.read()
+                st = os.stat(dirent.path)
+                files[dirent.path] = {"text": text, "stat": [st.st_ino, st.st_mtime_ns, st.st_size]}
+    return files
+
+
+def load_boot_entries(directory=BLS_ENTRIES_DIR, log=None):
+    """
+    Loads all BLS entries, sorted by file name. The entries directory is often root-only
+    (0700); in that case all files are read by a single privileged '--read-boot-entries' call.
+    """
+    try:
+        files = read_boot_entry_files(directory)
+    except PermissionError:
+        if log:
+            log(f"{directory} is not readable, reading boot entries with pkexec...\n")
+        result = subprocess.run(["pkexec", sys.executable, os.path.abspath(__file__), "--read-boot-entries"],
+                                capture_output=True, text=True, check=True)
+        files = json.loads(result.stdout)
+    return [BootEntry(path, data["text"], data["stat"]) for path, data in sorted(files.items())]
+
+
+def merged_cmdline_args(entries):
+    """Returns [(arg, number of entries using it)] over all entries, in first-seen order."""
+    counts = {}
+    for entry in entries:
+        for arg in dict.fromkeys(entry.args):
+            counts[arg] = counts.get(arg, 0) + 1
+    return list(counts.items())
+
+
+def boot_entries_payload(entries, extra=()):
+    """Builds the '--apply-files' payload that rewrites the given boot entries (plus 'extra' items)."""
+    return json.dumps([{"path": e.path, "content": e.render(), "expect": e.stat_key} for e in entries] + list(extra))
+
+
+def default_cmdline_payload(add=(), remove=()):
+    """
+    Applies an argument edit to the default command line, like 'grubby --update-kernel=ALL':
+    GRUB_CMDLINE_LINUX in /etc/default/grub (kernels installed later, grub2-mkconfig
+    --update-bls-cmdline) and /etc/kernel/cmdline if it exists. Returns the '--apply-files'
+    payload items for the files that change; the grub ConfigFile is left dirty until discarded.
+    """
+    items = []
+    grub = get_config(GRUB_DEFAULTS_PATH)
+    if grub.stat_key is not None:
+        args = split_cmdline(grub.get("GRUB_CMDLINE_LINUX", ""))
+        new_args = edit_cmdline(args, add, remove)
+        if new_args != args and grub.set("GRUB_CMDLINE_LINUX", " ".join(new_args)):
+            items.append({"path": grub.path, "content": grub.render(), "expect": grub.stat_key})
+    try:
+        with open(KERNEL_CMDLINE_PATH, "r") as f:
+            st = os.fstat(f.fileno())
+            args = split_cmdline(f.read())
+    except FileNotFoundError:
+        return items
+    new_args = edit_cmdline(args, add, remove)
+    if new_args != args:
+        items.append({"path": KERNEL_CMDLINE_PATH, "content": " ".join(new_args) + "\n",
+                      "expect": [st.st_ino, st.st_mtime_ns, st.st_size]})
+    return items
+
+
+# --- Cached kernel state (shared by the window, the D-Bus service and the collectors) ---
+RPMDB_DIRS = ["/usr/lib/sysimage/rpm", "/var/lib/rpm"]
+GRUBENV_PATH = "/boot/grub2/grubenv"
+# Per-kernel files installed in /boot ("vmlinuz-<version>", "initramfs-<version>.img"...)
+BOOT_FILE_PREFIXES = ["vmlinuz-", ".vmlinuz-", "initramfs-", "System.map-", "config-", "symvers-"]
+BOOT_FILE_SUFFIXES = [".hmac", "kdump.img", ".img", ".gz"]
+OPERATION_STATE_FILE = "last-operation.json"
+
+
+def boot_file_version(name):
+    """Returns the kernel version a /boot file belongs to, or None (rescue images, grub, efi...)."""
+    for prefix in BOOT_FILE_PREFIXES:
+        if name.startswith(prefix):
+            version = name[len(prefix):]
+            for suffix in BOOT_FILE_SUFFIXES:
+                if version.endswith(suffix):
+                    version = version[:-len(suffix)]
+                    break
+            if "rescue" in version or not version:
+                return None
+            return version
+    return None
+
+
+def boot_bytes_per_version(boot_dir="/boot"):
+    """Sums the size of the /boot files of each kernel version with a single directory scan."""
+    sizes = {}
+    with os.scandir(boot_dir) as it:
+        for dirent in it:
+            version = boot_file_version(dirent.name)
+            if version and dirent.is_file(follow_symlinks=False):
+                sizes[version] = sizes.get(version, 0) + dirent.stat(follow_symlinks=False).st_size
+    return sizes
+
+
+def record_operation(operation, duration, success):
+    """Remembers the latency and result of the last privileged operation (for the collector)."""
+    save_json_cache(OPERATION_STATE_FILE, {"operation": operation, "duration": round(duration, 3),
+                                           "success": bool(success), "timestamp": time.time()})
+
+
+def operation_name(cmd):
+    """Short name of a privileged command, e.g. 'dnf remove' or 'fkm apply-files'."""
+    args = [a for a in cmd[1:] if a != sys.executable]
+    if args and args[0] == os.path.abspath(__file__):
+        return "fkm " + " ".join(a.lstrip("-") for a in args[1:2])
+    words = [os.path.basename(args[0])] if args else []
+    if len(args) > 1 and not args[1].startswith("-") and "/" not in args[1]:
+        words.append(args[1])
+    elif len(args) > 1 and args[1].startswith("--"):
+        words.append(args[1].split("=", 1)[0])
+    return " ".join(words)
+
+
+def rpmdb_stat_key():
+    """Cheap fingerprint of the rpm database: changes whenever a package is installed or removed."""
+    for directory in RPMDB_DIRS:
+        try:
+            with os.scandir(directory) as it:
+                return sorted((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in it if e.is_file())
+        except OSError:
+            continue
+    return None
+
+
+def read_grubenv(path=GRUBENV_PATH):
+    """Parses grubenv (key=value lines padded with '#') into a dict."""
+    env = {}
+    with open(path, "r") as f:
+        for line in f:
+            if "=" in line and not line.startswith("#"):
+                key, _, value = line.rstrip("\n").partition("=")
+                env[key] = value
+    return env
+
+
+class KernelState:
+    """
+    In-memory read model of the kernel state. refresh() re-reads it (the rpm/dnf queries only
+    run when the rpm database changed) and then notifies the listeners registered with
+    add_listener(), from the refreshing thread. 'unavailable' names the fields that could not be
+    read without privilege or failed to query ("removable", "boot_entries", "default"): their
+    empty value means "unknown", not "none".
+    """
     def __init__(self):
-        Gtk.Window.__init__(self, title="Fedora Kernel Manager")
-        self.set_border_width(10)
-        self.set_default_size(1200, 700)
-
-        # --- UI Elements ---
-        self.liststore = Gtk.ListStore(str)
-        self.treeview = Gtk.TreeView(model=self.liststore)
-        renderer = Gtk.CellRendererText()
-        column = Gtk.TreeViewColumn("Installed Kernels", renderer, text=0)
-        self.treeview.append_column(column)
-        self.selection = self.treeview.get_selection()
-        self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
-
-        # Terminal-style text area for command output
-        self.terminal_buffer = Gtk.TextBuffer()
-        self.terminal_view = Gtk.TextView(buffer=self.terminal_buffer)
-        self.terminal_view.set_editable(False)
-        self.terminal_view.set_monospace(True)
-        self.terminal_view.set_cursor_visible(True)
-        self.terminal_view.set_name("terminal-output")
-        self.terminal_view.set_can_focus(True)
-
-        # Directly override background and text color for the terminal view
-        # This is the most robust way to ensure the desired colors,
-        # although override_background_color/override_color are deprecated in newer GTK versions.
-        terminal_bg_color = Gdk.RGBA(0, 0, 0, 1)  # Black
-        terminal_text_color = Gdk.RGBA(0, 1, 0, 1) # Green
-        self.terminal_view.override_background_color(Gtk.StateFlags.NORMAL, terminal_bg_color)
-        self.terminal_view.override_color(Gtk.StateFlags.NORMAL, terminal_text_color)
-
-        # Combined treeview and terminal in a vertical paned
-        self.vertical_content_paned = Gtk.Paned(orientation=Gtk.Orientation.VERTICAL)
-        self.vertical_content_paned.set_vexpand(True)
-        self.vertical_content_paned.set_hexpand(True)
-
-        scrollable_treelist = Gtk.ScrolledWindow()
-        scrollable_treelist.set_hexpand(True)
-        scrollable_treelist.set_vexpand(True)
-        scrollable_treelist.add(self.treeview)
-        self.vertical_content_paned.pack1(scrollable_treelist, resize=True, shrink=False)
-
-        terminal_scroll = Gtk.ScrolledWindow()
-        terminal_scroll.set_hexpand(True)
-        terminal_scroll.set_vexpand(True)
-        terminal_scroll.add(self.terminal_view)
-        self.vertical_content_paned.pack2(terminal_scroll, resize=True, shrink=False)
-
-        self.connect("show", self.on_window_show)
-
-        self.spinner = Gtk.Spinner()
-        self.spinner.set_halign(Gtk.Align.CENTER)
-        self.spinner.set_valign(Gtk.Align.CENTER)
-
-        # --- In-app Status Indicator ---
-        self.status_label = Gtk.Label()
-        self.status_label.set_halign(Gtk.Align.CENTER)
-        self.status_label.set_vexpand(False)
-        self.status_label.set_hexpand(False)
-        self.update_status_indicator("idle") # Set initial status
-
-        # --- Buttons ---
-        self.buttons_data = [
-            # Kernel Management
-            ("📋 عرض الأنوية", self.refresh_kernel_list),
-            ("💡 الكيرنل الحالي", self.show_current_kernel),
-            ("⭐ تعيين كيرنل افتراضي", self.set_default_kernel),
-            ("❌ حذف المحدد", self.remove_kernels),
-            ("🔎 عرض الأنوية القابلة للحذف", self.preview_old_kernels),
-            ("🧹 حذف الأنوية القديمة", self.remove_old_kernels),
-            ("🔍 تفاصيل النواة المحددة", self.show_selected_kernel_details_button),
-
-            # Rescue Kernel Management
-            ("♻️ تحديث نواة rescue", self.update_rescue_kernel),
-            ("📁 عرض ملفات rescue", self.show_rescue_files),
-            ("🗑️ إزالة rescue القديمة", self.remove_old_rescue),
-
-            # GRUB & System Management
-            ("🔄 توليد grub جديد", self.regenerate_grub),
-            ("⚙️ عرض إعدادات Grub", self.show_grub_settings),
-            ("🎛️ تعيين إدخال تمهيد افتراضي", self.set_default_boot_entry_by_index),
-            ("📊 عرض معلومات النظام", self.show_system_info),
-            ("⚙️ إدارة إعدادات DNF", self.manage_dnf_settings),
-            ("📸 إنشاء لقطة Btrfs", self.create_btrfs_snapshot),
-            ("🧼 Clear الشاشة", self.clear_screen),
-            ("📋 نسخ مخرج الطرفية", self.copy_terminal_output),
-            ("❓ حول البرنامج", self.show_about_dialog)
-        ]
-
-        # --- Button Styling ---
-        css = b"""
-        button {
-            background-color: #fff176; /* Yellowish background */
-            font-weight: bold;
-            padding: 6px; /* Reduced padding for smaller buttons */
-            border-radius: 5px; /* Rounded corners for buttons */
-            box-shadow: 2px 2px 5px rgba(0, 0, 0, 0.2); /* Subtle shadow */
-        }
-        button:hover {
-            background-color: #ffe082; /* Lighter yellow on hover */
-        }
-        button:active {
-            background-color: #ffca28; /* Darker yellow when pressed */
-            box-shadow: inset 1px 1px 3px rgba(0, 0, 0, 0.3); /* Inset shadow for pressed state */
+        self.installed = [] # Package names, as printed by 'rpm -q kernel'
+        self.removable = [] # Package names, as printed by 'dnf repoquery --installonly --latest-limit=-1'
+        self.running = os.uname().release
+        self.default = "" # Kernel version of the default boot entry
+        self.boot_entries = [] # (id, title, version)
+        self.boot_total_bytes = 0
+        self.boot_free_bytes = 0
+        self.kernel_boot_bytes = {} # Version -> bytes used in /boot
+        self.unavailable = [] # Fields whose value is unknown, see the class docstring
+        self.refreshed_at = 0.0
+        self.refresh_duration = 0.0
+        self._rpmdb_key = None
+        self._boot_dir_key = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() # Serializes refresh() callers that bypass the coordinator
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _query_packages(self, log=None):
+        if log:
+            log("\n$ rpm -q kernel\n")
+        result = subprocess.run(["rpm", "-q", "kernel"], capture_output=True, text=True)
+        # rpm prints "package kernel is not installed" with a non-zero status when there is none
+        installed = [l.strip() for l in result.stdout.splitlines() if l.strip()] if result.returncode == 0 else []
+        if log and result.stdout:
+            log(f"STDOUT:\n{result.stdout.strip()}\n")
+        removable = None # Unknown unless dnf answers
+        try:
+            # Installed packages only, from the local cache: no repository metadata download
+            result = subprocess.run(["dnf", "-C", "repoquery", "--installed", "--installonly", "--latest-limit=-1", "-q"],
+                                    capture_output=True, text=True, check=True)
+            removable = [l.strip() for l in result.stdout.splitlines() if l.strip()]
+        except (OSError, subprocess.CalledProcessError) as e:
+            if log:
+                log(f"dnf repoquery failed: {e}\n")
+        return installed, removable
+
+    def _query_boot(self):
+        """Returns (boot_entries, default, unavailable)."""
+        unavailable = []
+        entries = []
+        try:
+            entries = [BootEntry(path, data["text"]) for path, data in sorted(read_boot_entry_files().items())]
+        except FileNotFoundError:
+            pass # No BLS entries on this system
+        except OSError:
+            unavailable.append("boot_entries") # Root-only entries directory: not available without privilege
+        boot_entries = [(os.path.basename(e.path)[:-len(".conf")], e.title, e.version or "") for e in entries]
+
+        default = ""
+        grubenv_read = False
+        try:
+            saved_entry = read_grubenv().get("saved_entry", "")
+            grubenv_read = True
+            default = next((version for entry_id, _, version in boot_entries if entry_id == saved_entry), "")
+            # Fedora entry ids are <machine-id>-<version>, so the version is known without reading the entry
+            match = re.fullmatch(r"[0-9a-f]{32}-(.+)", saved_entry)
+            if not default and match and "boot_entries" in unavailable:
+                default = match.group(1)
+        except OSError:
+            pass
+        if not default:
+            try:
+                result = subprocess.run(["grubby", "--default-kernel"], capture_output=True, text=True)
+                if result.returncode == 0 and result.stdout.strip():
+                    default = os.path.basename(result.stdout.strip()).replace("vmlinuz-", "", 1)
+            except OSError:
+                pass
+        if not default and ("boot_entries" in unavailable or not grubenv_read):
+            unavailable.append("default")
+        return boot_entries, default, unavailable
+
+    def refresh(self, log=None):
+        with self._refresh_lock:
+            return self._refresh(log)
+
+    def _refresh(self, log=None):
+        started = time.monotonic()
+        rpmdb_key = rpmdb_stat_key()
+        # A failed dnf query is retried on the next refresh even if the rpm database did not change
+        if rpmdb_key is None or rpmdb_key != self._rpmdb_key or "removable" in self.unavailable:
+            installed, removable = self._query_packages(log)
+        else:
+            installed, removable = self.installed, self.removable
+        unavailable = ["removable"] if removable is None else []
+        boot_entries, default, boot_unavailable = self._query_boot()
+        unavailable += boot_unavailable
+        st = os.statvfs("/boot")
+        # Kernel files are added/removed/replaced by rename, which updates the directory mtime
+        boot_dir_key = os.stat("/boot").st_mtime_ns
+        if boot_dir_key != self._boot_dir_key:
+            kernel_boot_bytes = boot_bytes_per_version()
+        else:
+            kernel_boot_bytes = self.kernel_boot_bytes
+
+        with self._lock:
+            self.installed = installed
+            self.removable = removable or []
+            self.unavailable = unavailable
+            self.boot_entries = boot_entries
+            self.default = default
+            self.boot_total_bytes = st.f_blocks * st.f_frsize
+            self.boot_free_bytes = st.f_bavail * st.f_frsize
+            self.kernel_boot_bytes = kernel_boot_bytes
+            self._rpmdb_key = rpmdb_key
+            self._boot_dir_key = boot_dir_key
+            self.refreshed_at = time.time()
+            self.refresh_duration = time.monotonic() - started
+
+        for listener in self._listeners:
+            listener(self)
+        return self
+
+    def snapshot(self):
+        """Returns a consistent copy of the state as a dict."""
+        with self._lock:
+            return {
+                "installed": list(self.installed),
+                "removable": list(self.removable),
+                "running": self.running,
+                "default": self.default,
+                "boot_entries": list(self.boot_entries),
+                "boot_total_bytes": self.boot_total_bytes,
+                "boot_free_bytes": self.boot_free_bytes,
+                "kernel_boot_bytes": dict(self.kernel_boot_bytes),
+                "unavailable": list(self.unavailable),
+                "refreshed_at": self.refreshed_at,
+                "refresh_duration": self.refresh_duration,
+            }
+
+
+# --- Prometheus node_exporter textfile collector ---
+def _metric_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_metrics(snapshot, last_operation=None, collected_at=None):
+    """
+    Renders a KernelState snapshot (and the last recorded operation) in the Prometheus text format.
+    Fields the state could not read are left out instead of being reported as 0.
+    """
+    lines = []
+    unavailable = snapshot.get("unavailable", [])
+
+    def _metric(name, help_text, samples, metric_type="gauge"):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_metric_label(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    _metric("fkm_installed_kernels", "Number of installed kernel packages.",
+            [({}, len(snapshot["installed"]))])
+    if "removable" not in unavailable:
+        _metric("fkm_removable_kernels", "Number of old kernel packages that can be removed.",
+                [({}, len(snapshot["removable"]))])
+    _metric("fkm_state_field_available", "1 if the state field could be read on the last refresh.",
+            [({"field": field}, int(field not in unavailable)) for field in ("removable", "boot_entries", "default")])
+    _metric("fkm_boot_size_bytes", "Size of the /boot filesystem.",
+            [({}, snapshot["boot_total_bytes"])])
+    _metric("fkm_boot_free_bytes", "Free space on the /boot filesystem available to unprivileged users.",
+            [({}, snapshot["boot_free_bytes"])])
+    _metric("fkm_kernel_boot_bytes", "Bytes used in /boot by the files of each kernel version.",
+            [({"version": v}, size) for v, size in sorted(snapshot["kernel_boot_bytes"].items())])
+    if "default" not in unavailable:
+        _metric("fkm_running_kernel_is_default", "1 if the running kernel is the default boot kernel.",
+                [({"running": snapshot["running"], "default": snapshot["default"]},
+                  int(snapshot["running"] == snapshot["default"]))])
+    _metric("fkm_state_refresh_duration_seconds", "Time taken to refresh the kernel state.",
+            [({}, round(snapshot["refresh_duration"], 3))])
+    if collected_at is not None:
+        _metric("fkm_collector_last_success_timestamp_seconds", "When the collector last refreshed the state successfully.",
+                [({}, round(collected_at, 3))])
+    if last_operation:
+        labels = {"operation": last_operation.get("operation", "")}
+        _metric("fkm_last_operation_duration_seconds", "Duration of the last privileged operation.",
+                [(labels, last_operation.get("duration", 0))])
+        _metric("fkm_last_operation_success", "1 if the last privileged operation succeeded.",
+                [(labels, int(bool(last_operation.get("success"))))])
+        _metric("fkm_last_operation_timestamp_seconds", "When the last privileged operation finished.",
+                [(labels, round(last_operation.get("timestamp", 0), 3))])
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, text):
+    """Writes a .prom file atomically, so node_exporter never reads a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def run_textfile_collector(path, interval, operation_file=None, once=False):
+    """
+    Refreshes the cached state and rewrites the metrics file every 'interval' seconds. A failed
+    cycle is logged to stderr and leaves the previous file in place; its
+    fkm_collector_last_success_timestamp_seconds then shows how stale it is.
+    """
+    state = KernelState()
+    operation_file = operation_file or str(CACHE_DIR / OPERATION_STATE_FILE)
+    while True:
+        started = time.monotonic()
+        success = False
+        try:
+            state.refresh()
+            try:
+                with open(operation_file, "r") as f:
+                    last_operation = json.load(f)
+            except (OSError, ValueError):
+                last_operation = None
+            write_textfile(path, format_metrics(state.snapshot(), last_operation, collected_at=time.time()))
+            success = True
+        except Exception as e: # Keep collecting: one failed cycle must not stop the service
+            print(f"Collector cycle failed: {e}", file=sys.stderr)
+        if once:
+            return 0 if success else 1
+        time.sleep(max(1, interval - (time.monotonic() - started)))
+
+
+# --- D-Bus service ---
+DBUS_NAME = "org.nagarsky.KernelManager1"
+DBUS_PATH = "/org/nagarsky/KernelManager1"
+DBUS_INTERFACE_XML = f"""
+<node>
+  <interface name="{DBUS_NAME}">
+    <method name="Refresh"/>
+    <method name="GetState">
+      <arg type="a{{sv}}" name="state" direction="out"/>
+    </method>
+    <signal name="StateChanged"/>
+    <property name="InstalledKernels" type="as" access="read"/>
+    <property name="RemovableKernels" type="as" access="read"/>
+    <property name="RunningKernel" type="s" access="read"/>
+    <property name="DefaultKernel" type="s" access="read"/>
+    <property name="BootEntries" type="a(sss)" access="read"/>
+    <property name="BootTotalBytes" type="t" access="read"/>
+    <property name="BootFreeBytes" type="t" access="read"/>
+    <property name="LastRefresh" type="t" access="read"/>
+    <property name="Unavailable" type="as" access="read"/>
+  </interface>
+</node>
+"""
+
+
+class KernelStateService:
+    """
+    Exposes a KernelState on D-Bus. Reads are answered from the cached state; after every
+    refresh StateChanged and PropertiesChanged are emitted so clients can subscribe instead
+    of polling. Unavailable lists the fields that could not be read (e.g. "boot_entries" and
+    "default" when /boot/loader/entries is root-only and the service runs as a user), so clients
+    can tell an unknown value from an empty one. Test it on a private bus, e.g.:
+        dbus-run-session -- sh -c 'fkm.py --dbus-service & sleep 2;
+            gdbus call --session -d org.nagarsky.KernelManager1 -o /org/nagarsky/KernelManager1
+                       -m org.nagarsky.KernelManager1.GetState'
+    """
+    def __init__(self, state, connection, coordinator=None):
+        self.state = state
+        self.connection = connection
+        # Inside the GUI the window's coordinator is shared, so the service never refreshes alongside it
+        self.coordinator = coordinator or RefreshCoordinator(self._start_refresh)
+        self._last_values = {}
+        node_info = Gio.DBusNodeInfo.new_for_xml(DBUS_INTERFACE_XML)
+        self._registration_id = connection.register_object(
+            DBUS_PATH, node_info.interfaces[0], self._on_method_call, self._on_get_property, None)
+        self._last_values = self._property_values()
+        state.add_listener(lambda _state: GLib.idle_add(self._emit_changed))
+
+    def _property_values(self):
+        snapshot = self.state.snapshot()
+        return {
+            "InstalledKernels": GLib.Variant("as", snapshot["installed"]),
+            "RemovableKernels": GLib.Variant("as", snapshot["removable"]),
+            "RunningKernel": GLib.Variant("s", snapshot["running"]),
+            "DefaultKernel": GLib.Variant("s", snapshot["default"]),
+            "BootEntries": GLib.Variant("a(sss)", snapshot["boot_entries"]),
+            "BootTotalBytes": GLib.Variant("t", snapshot["boot_total_bytes"]),
+            "BootFreeBytes": GLib.Variant("t", snapshot["boot_free_bytes"]),
+            "LastRefresh": GLib.Variant("t", int(snapshot["refreshed_at"] * 1e6)),
+            "Unavailable": GLib.Variant("as", snapshot["unavailable"]),
         }
-        """
-        style_provider = Gtk.CssProvider()
-        style_provider.load_from_data(css)
-        screen = Gdk.Screen.get_default()
-        if screen:
-            Gtk.StyleContext.add_provider_for_screen(
-                screen, style_provider,
-                Gtk.STYLE_PROVIDER_PRIORITY_USER
-            )
 
-        # --- Layout ---
-        grid = Gtk.Grid(column_spacing=10, row_spacing=10)
-        self.action_buttons = []
-        for i, (label, callback) in enumerate(self.buttons_data):
-            btn = Gtk.Button(label=label)
-            btn.connect("clicked", callback)
-            grid.attach(btn, i % 2, i // 2, 1, 1) # 2 columns for buttons
-            self.action_buttons.append(btn)
-
-        right_panel_vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
-        right_panel_vbox.pack_start(grid, False, False, 0)
-        right_panel_vbox.pack_start(self.spinner, False, False, 0)
-        right_panel_vbox.pack_start(self.status_label, False, False, 0) # Add status label here
-
-        # Main horizontal box: vertical_content_paned | right_panel_vbox
-        main_hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-        
-        # The left panel now only contains the vertical_content_paned (kernel list + terminal)
-        main_hbox.pack_start(self.vertical_content_paned, True, True, 0)
-        main_hbox.pack_start(right_panel_vbox, False, False, 0)
-
-        self.add(main_hbox)
-
-    def update_status_indicator(self, status_type, message=""):
-        """Updates the in-app status indicator (icon/text)."""
-        if status_type == "running":
-            self.status_label.set_markup(f"<span foreground='#FFD700'>🔄 {message if message else 'جارٍ التنفيذ...'}</span>")
-        elif status_type == "success":
-            self.status_label.set_markup(f"<span foreground='#32CD32'>✅ {message if message else 'اكتمل بنجاح'}</span>")
-        elif status_type == "error":
-            self.status_label.set_markup(f"<span foreground='#FF4500'>❌ {message if message else 'فشل!'}</span>")
-        else: # idle
-            self.status_label.set_markup("<span foreground='#808080'>Idle</span>")
-
-    def show_selected_kernel_details_button(self, widget):
-        """Callback for the 'Show Selected Kernel Details' button."""
-        selected_kernels = self.get_selected_kernels()
-        if not selected_kernels:
-            self.show_info("الرجاء تحديد نواة لعرض تفاصيلها.")
-            return
-        
-        # Only show details for the first selected kernel if multiple are selected
-        kernel_name = selected_kernels[0]
-        self._show_kernel_details_in_dialog(kernel_name)
-
-    def _show_kernel_details_in_dialog(self, kernel_name):
-        """Fetches and displays detailed information for the selected kernel in a dialog."""
-        def _callback(success, output):
-            # Using keyword arguments for Gtk.MessageDialog constructor
-            dialog = Gtk.MessageDialog(
-                parent=self,
-                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-                message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.OK, # This is fine for MessageDialog
-                text=f"تفاصيل النواة: {kernel_name}"
-            )
-            
-            if success and output:
-                dialog.format_secondary_text(output) # Reverted to format_secondary_text
-            else:
-                dialog.format_secondary_text(f"تعذر الحصول على تفاصيل النواة: {kernel_name}\n\nيرجى التحقق من سجل الطرفية لمزيد من التفاصيل.")
-            
-            dialog.set_default_size(600, 400) # Set a reasonable size for the dialog
-            dialog.run()
-            dialog.destroy()
+    def _on_get_property(self, connection, sender, object_path, interface_name, property_name):
+        return self._property_values().get(property_name)
+
+    def _on_method_call(self, connection, sender, object_path, interface_name, method_name, parameters, invocation):
+        if method_name == "GetState":
+            invocation.return_value(GLib.Variant("(a{sv})", (self._property_values(),)))
+        elif method_name == "Refresh":
+            self.request_refresh()
+            invocation.return_value(None)
+        else:
+            invocation.return_dbus_error("org.freedesktop.DBus.Error.UnknownMethod", method_name)
 
-        # rpm -qi provides detailed info about installed package
-        self.run_command_async(["rpm", "-qi", kernel_name],
-                               show_output=True,
-                               error_msg=f"فشل الحصول على تفاصيل {kernel_name}.",
-                               callback=_callback)
-
-    def on_window_show(self, widget):
-        # Set initial position for main content paned (kernel list & terminal)
-        total_height = self.vertical_content_paned.get_allocation().height
-        self.vertical_content_paned.set_position(total_height // 4)
-        
-        self.refresh_kernel_list(None) # Automatically refresh kernel list on startup
-
-    def log_terminal(self, text):
-        """Appends text to the terminal output area and scrolls to the end."""
-        end_iter = self.terminal_buffer.get_end_iter()
-        self.terminal_buffer.insert(end_iter, text)
-        self.terminal_view.scroll_mark_onscreen(self.terminal_buffer.get_insert())
-
-    def set_buttons_sensitive(self, sensitive):
-        """Sets the sensitivity of all action buttons."""
-        for btn in self.action_buttons:
-            if btn.get_label() != "🧼 Clear الشاشة": # Keep Clear Screen sensitive
-                btn.set_sensitive(sensitive)
-
-    def run_command_async(self, cmd, error_msg="حدث خطأ.", show_output=False, use_shell=False, callback=None, raise_on_error=True):
-        """
-        Runs a shell command asynchronously in a separate thread.
-        Logs STDOUT and STDERR to the terminal view.
-        Updates in-app status indicator.
-        'raise_on_error': If False, a non-zero exit code will not raise CalledProcessError,
-                          but 'success' in callback will be False. Useful for commands like 'grep'.
-        """
-        self.spinner.start()
-        self.set_buttons_sensitive(False)
-        self.update_status_indicator("running", "جارٍ التنفيذ...") # Set status to running
+    def request_refresh(self):
+        """Requests a refresh through the coordinator; bursts of requests are merged into one refresh."""
+        self.coordinator.request()
 
+    def _start_refresh(self, done):
+        """Refreshes the state in a worker thread; 'done(success, state)' runs on the main loop."""
         def _run():
             success = False
-            output = None
             try:
-                if use_shell:
-                    cmd_str = ' '.join(cmd) if isinstance(cmd, list) else cmd
-                else:
-                    cmd_list = cmd.split() if isinstance(cmd, str) else cmd
+                self.state.refresh()
+                success = True
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Refresh failed: {e}", file=sys.stderr)
+            finally:
+                GLib.idle_add(done, success, self.state)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _emit_changed(self):
+        values = self._property_values()
+        changed = {k: v for k, v in values.items() if self._last_values.get(k) != v}
+        self._last_values = values
+        if changed:
+            self.connection.emit_signal(None, DBUS_PATH, "org.freedesktop.DBus.Properties", "PropertiesChanged",
+                                        GLib.Variant("(sa{sv}as)", (DBUS_NAME, changed, [])))
+        self.connection.emit_signal(None, DBUS_PATH, DBUS_NAME, "StateChanged", None)
+        return False
+
+
+def start_dbus_service(state, bus_type=None, address=None, on_ready=None, coordinator=None):
+    """
+    Owns DBUS_NAME on the session/system bus (or on the bus at 'address') and exports 'state'.
+    Returns the bus name owner id. 'on_ready(service)' is called once the object is exported.
+    Refresh requests go through 'coordinator' (a RefreshCoordinator), if given.
+    """
+    if bus_type is None:
+        bus_type = Gio.BusType.SESSION
+    def _on_bus_acquired(connection, name):
+        service = KernelStateService(state, connection, coordinator)
+        if on_ready:
+            on_ready(service)
+
+    def _on_name_lost(connection, name):
+        print(f"D-Bus name {name} is not available (already owned or no bus).", file=sys.stderr)
+
+    if address:
+        connection = Gio.DBusConnection.new_for_address_sync(
+            address,
+            Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION,
+            None, None)
+        _on_bus_acquired(connection, DBUS_NAME)
+        return Gio.bus_own_name_on_connection(connection, DBUS_NAME, Gio.BusNameOwnerFlags.NONE,
+                                              None, _on_name_lost)
+    return Gio.bus_own_name(bus_type, DBUS_NAME, Gio.BusNameOwnerFlags.NONE,
+                            _on_bus_acquired, None, _on_name_lost)
+
+
+# --- Kernel image (vmlinuz) headers ---
+KERNEL_IMAGE_CACHE = "kernel-image-versions.json"
+_kernel_image_memory = {}
+
+
+def read_kernel_image_version(path):
+    """
+    Reads the version a kernel image was built as ("6.5.6-300.fc39.x86_64"), without loading
+    the image: on x86 the boot protocol header ("HdrS" at 0x202) points to the version string,
+    so only the first pages of the mmap are touched. Other images are searched for the
+    "Linux version" banner, which only exists in uncompressed images. Returns None if unknown.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < 0x210:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[0x1FE:0x200] == b"\x55\xaa" and mm[0x202:0x206] == b"HdrS":
+                protocol = struct.unpack_from("<H", mm, 0x206)[0]
+                kernel_version = struct.unpack_from("<H", mm, 0x20E)[0]
+                if protocol >= 0x200 and kernel_version:
+                    start = kernel_version + 0x200
+                    end = mm.find(b"\x00", start, start + 256)
+                    if end > start:
+                        return mm[start:end].decode("ascii", "replace").split()[0]
+            start = mm.find(b"Linux version ")
+            if start >= 0:
+                end = mm.find(b" ", start + 14, start + 256)
+                if end > start:
+                    return mm[start + 14:end].decode("ascii", "replace")
+    return None
+
+
+def kernel_image_version(path):
+    """read_kernel_image_version() cached by inode/mtime/size, in memory and in CACHE_DIR."""
+    st = os.stat(path)
+    key = [st.st_ino, st.st_mtime_ns, st.st_size]
+    if not _kernel_image_memory:
+        _kernel_image_memory.update(load_json_cache(KERNEL_IMAGE_CACHE))
+    cached = _kernel_image_memory.get(path)
+    if cached and cached["key"] == key:
+        return cached["version"]
+    version = read_kernel_image_version(path)
+    _kernel_image_memory[path] = {"key": key, "version": version}
+    save_json_cache(KERNEL_IMAGE_CACHE, {p: c for p, c in _kernel_image_memory.items() if os.path.exists(p)})
+    return version
+
+
+def scan_kernel_images(boot_dir="/boot"):
+    """
+    Returns one dict per /boot/vmlinuz-* file: path, the version from its header ('version'),
+    the version implied by its name ('name_version', None for rescue images) and 'rescue'.
+    """
+    images = []
+    for name in sorted(os.listdir(boot_dir)):
+        if not name.startswith("vmlinuz-"):
+            continue
+        path = os.path.join(boot_dir, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            version = kernel_image_version(path)
+        except OSError:
+            version = None
+        rescue = "-rescue-" in name or name.startswith("vmlinuz-rescue")
+        images.append({"path": path, "version": version, "rescue": rescue,
+                       "name_version": None if rescue else name[len("vmlinuz-"):]})
+    return images
+
+
+def find_kernel_image(version, boot_dir="/boot"):
+    """Path of the non-rescue image whose header matches 'version' (the conventional name first)."""
+    conventional = os.path.join(boot_dir, f"vmlinuz-{version}")
+    images = [i for i in scan_kernel_images(boot_dir) if not i["rescue"] and i["version"] == version]
+    if any(i["path"] == conventional for i in images) or not images:
+        return conventional
+    return images[0]["path"]
+
+
+def read_machine_id(path="/etc/machine-id"):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _rescue_boot_entry(suffix, image, boot_dir):
+    """
+    The BLS entry that boots a rescue set: the entry whose 'linux' line names the rescue vmlinuz,
+    or, when the entries directory is root-only, the conventional <machine-id>-0-rescue.conf.
+    """
+    entries_dir = os.path.join(boot_dir, "loader", "entries")
+    try:
+        for path, data in read_boot_entry_files(entries_dir).items():
+            linux = BootEntry(path, data["text"]).get("linux") or ""
+            if image and os.path.basename(linux) == os.path.basename(image):
+                return path
+    except FileNotFoundError:
+        return None
+    except PermissionError:
+        pass
+    if suffix.startswith("0-rescue-"):
+        conventional = os.path.join(entries_dir, f"{suffix[len('0-rescue-'):]}-0-rescue.conf")
+        # A root-only entries directory cannot be listed, but the entry path itself can be checked
+        if os.path.lexists(conventional) or not os.access(entries_dir, os.R_OK):
+            return conventional
+    return None
+
+
+def rescue_image_sets(boot_dir="/boot", machine_id=None):
+    """
+    Groups rescue files by their suffix (vmlinuz-0-rescue-<machine id>, initramfs-0-rescue-<id>.img,
+    .vmlinuz-0-rescue-<id>.hmac) and returns one dict per set: 'suffix', 'version' (from the vmlinuz
+    header, or None), 'paths' (files in /boot), 'entry' (its BLS entry, or None), 'mtime' (of the
+    vmlinuz, 0 without one) and 'machine' (True for this machine's 0-rescue-<machine-id> set).
+    """
+    if machine_id is None:
+        machine_id = read_machine_id()
+    sets = {}
+    for image in scan_kernel_images(boot_dir):
+        if image["rescue"]:
+            suffix = os.path.basename(image["path"])[len("vmlinuz-"):]
+            rescue_set = sets.setdefault(suffix, {"suffix": suffix, "paths": [], "image": None})
+            rescue_set["paths"].append(image["path"])
+            rescue_set["image"] = image["path"]
+            rescue_set["version"] = image["version"]
+    for name in sorted(os.listdir(boot_dir)):
+        if "rescue" not in name:
+            continue
+        for prefix, extension in (("initramfs-", ".img"), (".vmlinuz-", ".hmac")):
+            if name.startswith(prefix) and name.endswith(extension):
+                suffix = name[len(prefix):-len(extension)]
+                sets.setdefault(suffix, {"suffix": suffix, "paths": [], "image": None})["paths"].append(
+                    os.path.join(boot_dir, name))
+
+    result = []
+    for suffix, rescue_set in sorted(sets.items()):
+        image = rescue_set.pop("image")
+        try:
+            mtime = os.path.getmtime(image) if image else 0
+        except OSError:
+            mtime = 0
+        rescue_set.update(version=rescue_set.get("version"), mtime=mtime,
+                          entry=_rescue_boot_entry(suffix, image, boot_dir),
+                          machine=bool(machine_id) and suffix == f"0-rescue-{machine_id}")
+        result.append(rescue_set)
+    return result
+
+
+def rescue_set_files(rescue_set):
+    """All the files of a rescue set, its BLS entry included."""
+    return rescue_set["paths"] + ([rescue_set["entry"]] if rescue_set["entry"] else [])
+
+
+def _has_image(rescue_set):
+    return any(os.path.basename(p).startswith("vmlinuz-") for p in rescue_set["paths"])
+
+
+def old_rescue_sets(rescue_sets, version, for_rebuild=False):
+    """
+    The rescue sets that do not belong to kernel 'version'. A set whose version cannot be read
+    is kept, unless it has no vmlinuz at all (a leftover initramfs/hmac). Unless 'for_rebuild'
+    (the caller rebuilds the rescue image and restores the old one on failure), this machine's
+    0-rescue-<machine-id> set is kept while no newer rescue set exists (it is usually built
+    once, from an older kernel), and the newest set with a vmlinuz is always kept.
+    """
+    old = []
+    for rescue_set in rescue_sets:
+        if rescue_set["version"] == version or (rescue_set["version"] is None and _has_image(rescue_set)):
+            continue
+        if rescue_set["machine"] and not for_rebuild and _has_image(rescue_set):
+            newer = [r for r in rescue_sets if r is not rescue_set and _has_image(r) and r["mtime"] > rescue_set["mtime"]]
+            if not newer:
+                continue
+        old.append(rescue_set)
+
+    if not for_rebuild:
+        bootable = [r for r in rescue_sets if _has_image(r)]
+        if bootable and all(r in old for r in bootable):
+            newest = max(bootable, key=lambda r: r["mtime"])
+            old = [r for r in old if r is not newest]
+    return old
+
+
+def rescue_update_plan(version, boot_dir="/boot", modules_dir="/lib/modules"):
+    """
+    Decides whether the rescue image needs rebuilding for kernel 'version', from one scan of /boot:
+    'up_to_date' if a rescue vmlinuz of that version exists, is the same size as the kernel's
+    image and its initramfs is newer than the module tree (modules.dep). Otherwise the space
+    needed is estimated from the current rescue files and compared with the statvfs free space;
+    'reclaimable' lists the rescue files of other kernels that could be removed first.
+    'rebuild_files' are the files of this machine's 0-rescue-<machine-id> set: dracut's rescue
+    plugin skips the build while they exist, so they must be moved aside for a rebuild.
+    """
+    kernel_image = os.path.join(modules_dir, version, "vmlinuz")
+    modules_dep = os.path.join(modules_dir, version, "modules.dep")
+    sets = rescue_image_sets(boot_dir)
+
+    up_to_date = False
+    for rescue_set in sets:
+        if rescue_set["version"] != version:
+            continue
+        images = [p for p in rescue_set["paths"] if os.path.basename(p).startswith("vmlinuz-")]
+        initramfs = [p for p in rescue_set["paths"] if os.path.basename(p).startswith("initramfs-")]
+        try:
+            same_image = all(os.path.getsize(p) == os.path.getsize(kernel_image) for p in images)
+            modules_mtime = os.path.getmtime(modules_dep) if os.path.exists(modules_dep) else 0
+            fresh = all(os.path.getmtime(p) >= modules_mtime for p in initramfs)
+        except OSError:
+            continue
+        if images and initramfs and same_image and fresh:
+            up_to_date = True
+
+    reclaimable = []
+    for rescue_set in old_rescue_sets(sets, version, for_rebuild=True):
+        reclaimable += [(p, os.path.getsize(p)) for p in rescue_set["paths"]]
+        # The rebuild writes this machine's entry again; other sets must not leave a dangling entry
+        if rescue_set["entry"] and not rescue_set["machine"]:
+            reclaimable.append((rescue_set["entry"], 0))
+    rescue_sizes = [sum(os.path.getsize(p) for p in r["paths"]) for r in sets]
+    if rescue_sizes:
+        needed = max(rescue_sizes)
+    else:
+        # No rescue image yet: the generic initramfs is typically several times the host-only one
+        initramfs = os.path.join(boot_dir, f"initramfs-{version}.img")
+        needed = os.path.getsize(kernel_image) + 3 * (os.path.getsize(initramfs) if os.path.exists(initramfs) else 0)
+    needed = int(needed * 1.1) # Margin for growth since the last rescue build
+    st = os.statvfs(boot_dir)
+    return {"version": version, "kernel_image": kernel_image, "up_to_date": up_to_date,
+            "needed": needed, "free": st.f_bavail * st.f_frsize, "reclaimable": reclaimable,
+            "rebuild_files": [p for r in sets if r["machine"] for p in rescue_set_files(r)]}
+
+
+# sh -c script: $1 kernel version, $2 vmlinuz, then the rescue files to replace or free. They are
+# moved to a backup directory outside /boot, deleted after a successful build, restored otherwise.
+RESCUE_REBUILD_SCRIPT = r'''
+v="$1"; img="$2"; shift 2
+backup=$(mktemp -d /var/tmp/fkm-rescue.XXXXXX) || exit 1
+restore() {
+    for f in "$@"; do
+        if [ -e "$backup$f" ]; then mv -f -- "$backup$f" "$f"; fi
+    done
+    rm -rf -- "$backup"
+}
+for f in "$@"; do
+    if ! { mkdir -p -- "$backup$(dirname -- "$f")" && mv -- "$f" "$backup$f"; }; then
+        restore "$@"
+        exit 1
+    fi
+done
+if kernel-install add "$v" "$img"; then
+    rm -rf -- "$backup"
+else
+    status=$?
+    restore "$@"
+    exit $status
+fi
+'''
+
+
+def format_size(size):
+    """Human readable size, e.g. '85.3 MiB'."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def installed_kernel_versions():
+    """Versions (VERSION-RELEASE.ARCH) of the installed kernel-core/kernel packages."""
+    result = subprocess.run(["rpm", "-q", "--qf", "%{VERSION}-%{RELEASE}.%{ARCH}\\n", "kernel-core", "kernel"],
+                            capture_output=True, text=True)
+    # Packages that are not installed are reported as "package X is not installed" lines
+    return sorted({l.strip() for l in result.stdout.splitlines() if l.strip() and " " not in l.strip()})
+
+
+def kernel_image_report(installed_versions, boot_dir="/boot"):
+    """
+    Returns [(path, header version, status)] for every /boot/vmlinuz-* image. Status is one of
+    "ok", "unknown-version", "misnamed" (the file name has another version), "no-package",
+    "no-modules", "rescue" or "rescue-removed-kernel".
+    """
+    rows = []
+    installed = set(installed_versions)
+    for image in scan_kernel_images(boot_dir):
+        version = image["version"]
+        if version is None:
+            status = "unknown-version"
+        elif image["rescue"]:
+            status = "rescue" if version in installed else "rescue-removed-kernel"
+        elif version != image["name_version"]:
+            status = "misnamed"
+        elif version not in installed:
+            status = "no-package"
+        elif not os.path.isdir(f"/lib/modules/{version}"):
+            status = "no-modules"
+        else:
+            status = "ok"
+        rows.append((image["path"], version, status))
+    return rows
+
+
+# --- Kernel package integrity (rpm -V without the serial walk) ---
+RPM_DIGEST_CACHE = "rpm-digest-cache.json"
+RPM_DIGEST_ALGOS = {1: "md5", 2: "sha1", 8: "sha256", 9: "sha384", 10: "sha512", 11: "sha224"}
+RPMFILE_MISSINGOK = 8
+RPMFILE_GHOST = 64
+
+
+# The packages a kernel version is made of; 'kernel*' would also match kernelshark, kernel-tools-libs-devel...
+KERNEL_PACKAGE_PATTERNS = ["kernel", "kernel-core", "kernel-modules*", "kernel-devel"]
+
+
+def query_kernel_packages():
+    """
+    Returns {kernel version: [installed package NVRAs]} for the packages of the installed kernels,
+    i.e. the versions with a kernel-core package (or kernel, before the core/modules split).
+    """
+    result = subprocess.run(["rpm", "-qa", "--qf", "%{NAME}\t%{VERSION}-%{RELEASE}.%{ARCH}\n"] + KERNEL_PACKAGE_PATTERNS,
+                            capture_output=True, text=True, check=True)
+    packages = {}
+    kernels = set()
+    for line in result.stdout.splitlines():
+        name, _, version = line.partition("\t")
+        packages.setdefault(version, []).append(f"{name}-{version}")
+        if name in ("kernel", "kernel-core"):
+            kernels.add(version)
+    return {version: names for version, names in packages.items() if version in kernels}
+
+
+def query_package_files(packages):
+    """Returns (package, path, digest, size, mode, flags, algorithm) for every file of 'packages', in one rpm call."""
+    qf = ("[%{=NAME}-%{=VERSION}-%{=RELEASE}.%{=ARCH}\t%{FILENAMES}\t%{FILEDIGESTS}\t%{FILESIZES}"
+          "\t%{FILEMODES}\t%{FILEFLAGS}\t%{=FILEDIGESTALGO}\n]")
+    result = subprocess.run(["rpm", "-q", "--qf", qf] + list(packages), capture_output=True, text=True, check=True)
+    files = []
+    for line in result.stdout.splitlines():
+        parts = line.split("\t")
+        if len(parts) != 7:
+            continue
+        package, path, digest, size, mode, flags, algo = parts
+        algorithm = RPM_DIGEST_ALGOS.get(int(algo), "md5") if algo.isdigit() else "md5"
+        files.append((package, path, digest, int(size), int(mode), int(flags), algorithm))
+    return files
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk) # hashlib releases the GIL on large buffers, so threads hash in parallel
+    return digest.hexdigest()
+
+
+def verify_kernels(versions=None, log=None, workers=None):
+    """
+    Checks the files of the kernel packages against their rpm digests, hashing in parallel.
+    Digests are cached by path+inode+mtime+size, so a repeated check only hashes changed files.
+    Returns one report per kernel version: packages, counts, and the modified/missing files.
+    """
+    kernels = query_kernel_packages()
+    if versions:
+        kernels = {v: p for v, p in kernels.items() if v in versions}
+    cache = load_json_cache(RPM_DIGEST_CACHE)
+    reports = {v: {"version": v, "packages": sorted(p), "files": 0, "hashed": 0, "cached": 0,
+                   "modified": [], "missing": [], "unreadable": []} for v, p in kernels.items()}
+    package_version = {p: v for v, ps in kernels.items() for p in ps}
+    if not package_version:
+        return []
+
+    to_hash = [] # (report, path, expected digest, algorithm, stat key)
+    for package, path, digest, size, mode, flags, algorithm in query_package_files(package_version):
+        if package not in package_version:
+            continue
+        report = reports[package_version[package]]
+        if flags & RPMFILE_GHOST or not stat.S_ISREG(mode) or not digest:
+            continue
+        report["files"] += 1
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if not flags & RPMFILE_MISSINGOK:
+                report["missing"].append(path)
+            continue
+        except PermissionError:
+            report["unreadable"].append(path)
+            continue
+        if st.st_size != size:
+            report["modified"].append(path)
+            continue
+        key = [st.st_ino, st.st_mtime_ns, st.st_size, algorithm]
+        cached = cache.get(path)
+        if cached and cached[:4] == key:
+            report["cached"] += 1
+            if cached[4] != digest:
+                report["modified"].append(path)
+            continue
+        to_hash.append((report, path, digest, algorithm, key))
+
+    if log:
+        log(f"Hashing {len(to_hash)} files ({sum(r['cached'] for r in reports.values())} unchanged files taken from cache)...\n")
+
+    def _hash(item):
+        report, path, digest, algorithm, key = item
+        try:
+            return item, file_digest(path, algorithm), None
+        except OSError as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+        for (report, path, digest, algorithm, key), actual, error in executor.map(_hash, to_hash):
+            if error is not None:
+                (report["missing"] if isinstance(error, FileNotFoundError) else report["unreadable"]).append(path)
+                continue
+            report["hashed"] += 1
+            cache[path] = key + [actual]
+            if actual != digest:
+                report["modified"].append(path)
+
+    for report in reports.values():
+        for path in report["missing"]:
+            cache.pop(path, None)
+    save_json_cache(RPM_DIGEST_CACHE, cache)
+    for report in reports.values():
+        report["status"] = verification_status(report)
+    return [reports[v] for v in sorted(reports)]
+
+
+def verification_status(report):
+    """
+    'modified' if a file differs or is missing, 'incomplete' if some files could not be read
+    (e.g. the 0600 /boot/System.map-* without root) and so were never checked, else 'ok'.
+    """
+    if report["modified"] or report["missing"]:
+        return "modified"
+    return "incomplete" if report["unreadable"] else "ok"
+
+
+# --- initramfs (cpio) inspection ---
+# One index file per image, named after its dev+inode+mtime+size, plus a small path -> file manifest
+INITRAMFS_INDEX_MANIFEST = "initramfs-indexes.json"
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+COMPRESSION_MAGICS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x5d\x00\x00", "lzma"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"BZh", "bzip2"),
+    (b"\x02\x21\x4c\x18", "lz4"),
+]
+CPIO_TYPES = {0o040000: "d", 0o100000: "f", 0o120000: "l", 0o020000: "c", 0o060000: "b",
+              0o010000: "p", 0o140000: "s"}
+
+
+class _CountingReader:
+    """Exact reads/skips over a (possibly non-seekable) stream, tracking the offset for cpio padding."""
+    def __init__(self, stream, seekable=False):
+        self.stream = stream
+        self.seekable = seekable
+        self.offset = 0
+
+    def read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        self.offset += len(data)
+        return data
+
+    def skip(self, size):
+        if self.seekable:
+            self.stream.seek(size, os.SEEK_CUR)
+            self.offset += size
+            return
+        while size > 0:
+            chunk = self.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            size -= len(chunk)
 
-                GLib.idle_add(self.log_terminal, f"\n$ {cmd_str if use_shell else ' '.join(cmd_list)}\n")
+    def align(self, alignment=4):
+        self.skip(-self.offset % alignment)
 
-                result = subprocess.run(cmd_list if not use_shell else cmd_str,
-                                        capture_output=True, text=True, check=raise_on_error, shell=use_shell)
 
-                if result.stdout:
-                    GLib.idle_add(self.log_terminal, f"STDOUT:\n{result.stdout.strip()}\n")
-                if result.stderr:
-                    GLib.idle_add(self.log_terminal, f"STDERR:\n{result.stderr.strip()}\n")
+def _iter_cpio(reader, segment):
+    """Yields [path, type, mode, size, mtime, segment, link target] for each member of one newc archive."""
+    while True:
+        header = reader.read(CPIO_HEADER_SIZE)
+        if len(header) < CPIO_HEADER_SIZE:
+            return
+        if header[:6] not in (b"070701", b"070702"):
+            raise ValueError(f"bad cpio header at segment {segment}")
+        fields = [int(header[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+        mode, mtime, size, namesize = fields[1], fields[5], fields[6], fields[11]
+        name = reader.read(namesize).rstrip(b"\x00").decode("utf-8", "replace")
+        reader.align()
+        if name == CPIO_TRAILER:
+            return
+        entry_type = CPIO_TYPES.get(mode & 0o170000, "?")
+        target = ""
+        if entry_type == "l":
+            target = reader.read(size).decode("utf-8", "replace")
+        else:
+            reader.skip(size)
+        reader.align()
+        path = "/" + name[2:] if name.startswith("./") else "/" + name.lstrip("/") if name != "." else "/"
+        yield [path, entry_type, mode & 0o7777, size, mtime, segment, target]
+
+
+def _decompressed_stream(path, offset, compression):
+    """Opens a decompressing reader over 'path' from 'offset'. Returns (stream, process or None)."""
+    raw = open(path, "rb")
+    raw.seek(offset)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw), None
+    if compression in ("xz", "lzma"):
+        return lzma.LZMAFile(raw), None
+    if compression == "bzip2":
+        return bz2.BZ2File(raw), None
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True), None
+    tool = {"zstd": "zstd", "lz4": "lz4"}.get(compression)
+    if tool and shutil.which(tool):
+        proc = subprocess.Popen([tool, "-dcq"], stdin=raw, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        raw.close()
+        return proc.stdout, proc
+    raw.close()
+    raise ValueError(f"no {compression} decompressor available (install python3-zstandard or {compression})")
+
+
+def iter_initramfs(path):
+    """
+    Stream-parses an initramfs image and yields its entries lazily. Uncompressed cpio segments
+    (early microcode) are read in place and skipped with seeks; the compressed main archive
+    is decompressed on the fly, never as a whole.
+    """
+    with open(path, "rb") as fh:
+        reader = _CountingReader(fh, seekable=True)
+        segment = 0
+        while True:
+            # Segments are padded with zeros up to a 4-byte boundary (or more)
+            magic = fh.read(8)
+            while magic and not magic.strip(b"\x00"):
+                magic = fh.read(8)
+            if not magic:
+                return
+            start = fh.tell() - len(magic) + (len(magic) - len(magic.lstrip(b"\x00")))
+            fh.seek(start)
+            magic = fh.read(8)
+            fh.seek(start)
+            if magic.startswith(b"0707"):
+                reader.offset = 0
+                yield from _iter_cpio(reader, segment)
+                segment += 1
+                continue
+
+            compression = next((name for m, name in COMPRESSION_MAGICS if magic.startswith(m)), None)
+            if compression is None:
+                raise ValueError(f"unknown data at offset {start} of {path}")
+            stream, proc = _decompressed_stream(path, start, compression)
+            try:
+                yield from _iter_cpio(_CountingReader(stream), segment)
+            finally:
+                stream.close()
+                if proc:
+                    proc.kill()
+                    proc.wait()
+            return # The compressed archive is the last segment
 
-                if show_output:
-                    output = result.stdout.strip()
-                
-                # Determine success based on return code if raise_on_error is False
-                if not raise_on_error and result.returncode != 0:
-                    success = False
-                    GLib.idle_add(self.log_terminal, f"Command exited with non-zero status: {result.returncode}\n")
-                else:
-                    success = True
 
-                if success:
-                    self.update_status_indicator("success", "اكتمل بنجاح")
+def _initramfs_stat_key(path):
+    st = os.stat(path)
+    return [st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+_initramfs_index_memory = {}
+
+
+def _initramfs_index_name(key):
+    return "initramfs-index-" + "-".join(str(k) for k in key) + ".json"
+
+
+def _save_initramfs_index(path, key, entries):
+    """Writes the index of one image and drops the index files of replaced or removed images."""
+    name = _initramfs_index_name(key)
+    save_json_cache(name, entries)
+    manifest = load_json_cache(INITRAMFS_INDEX_MANIFEST)
+    manifest[path] = name
+    for image_path, index_name in list(manifest.items()):
+        if image_path != path and not os.path.exists(image_path):
+            del manifest[image_path]
+    live = set(manifest.values())
+    for index_file in CACHE_DIR.glob("initramfs-index-*.json"):
+        if index_file.name not in live:
+            try:
+                index_file.unlink()
+            except OSError:
+                pass
+    save_json_cache(INITRAMFS_INDEX_MANIFEST, manifest)
+
+
+def iter_initramfs_index(path, log=None):
+    """
+    Yields the entries of an initramfs lazily, from its own index file (named after the image's
+    dev+inode+mtime+size) when the image did not change, so only that image's index is read.
+    Otherwise the image is parsed (through pkexec when it is root-only) and its index is cached.
+    """
+    key = _initramfs_stat_key(path)
+    cached = _initramfs_index_memory.get(path)
+    if cached is None or cached["key"] != key:
+        entries = load_json_cache(_initramfs_index_name(key), default=[])
+        cached = {"key": key, "entries": entries} if entries else None
+    if cached:
+        _initramfs_index_memory[path] = cached
+        yield from cached["entries"]
+        return
+
+    entries = []
+    if os.access(path, os.R_OK):
+        for entry in iter_initramfs(path):
+            entries.append(entry)
+            yield entry
+    else:
+        if log:
+            log(f"{path} is not readable, indexing it with pkexec...\n")
+        cmd = ["pkexec", sys.executable, os.path.abspath(__file__), "--initramfs-index", path]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+            for line in proc.stdout:
+                entry = json.loads(line)
+                entries.append(entry)
+                yield entry
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    _initramfs_index_memory[path] = {"key": key, "entries": entries}
+    _save_initramfs_index(path, key, entries)
+
+
+def compare_initramfs(entries_a, entries_b):
+    """Returns [(path, status, size a, size b)] for entries only in one image or differing in size/type."""
+    index_a = {e[0]: e for e in entries_a}
+    index_b = {e[0]: e for e in entries_b}
+    differences = []
+    for path in sorted(set(index_a) | set(index_b)):
+        a, b = index_a.get(path), index_b.get(path)
+        if a is None:
+            differences.append((path, "added", None, b[3]))
+        elif b is None:
+            differences.append((path, "removed", a[3], None))
+        elif a[1] != b[1] or a[3] != b[3] or a[6] != b[6]:
+            differences.append((path, "changed", a[3], b[3]))
+    return differences
+
+
+def list_initramfs_images(boot_dir="/boot"):
+    """Returns the initramfs images in /boot, rescue images last."""
+    images = sorted(os.path.join(boot_dir, n) for n in os.listdir(boot_dir)
+                    if n.startswith("initramfs-") and n.endswith(".img"))
+    return [p for p in images if "rescue" not in p] + [p for p in images if "rescue" in p]
+
+
+# --- Fleet mode: the kernel operations on many hosts ---
+def ssh_control_dir():
+    """
+    Private directory for the SSH master sockets: anyone who can open a socket can run commands
+    on its host, so never a shared one like /tmp. $XDG_RUNTIME_DIR is already private (0700);
+    otherwise a 0700 directory under CACHE_DIR is used.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return runtime_dir
+    directory = CACHE_DIR / "ssh"
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chmod(directory, 0o700) # mkdir does not change the mode of an existing directory
+    return str(directory)
+
+
+class SSHTransport:
+    """
+    Runs commands on a host over OpenSSH. All commands to a host share one persistent,
+    multiplexed master connection (ControlMaster=auto + ControlPersist), which also survives
+    between fkm runs, so only the first command pays for the SSH handshake.
+    """
+    def __init__(self, host, connect_timeout=10):
+        self.host = host
+        self.ssh = ["ssh", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={connect_timeout}",
+                    "-o", "ControlMaster=auto", "-o", "ControlPersist=300",
+                    "-o", f"ControlPath={ssh_control_dir()}/fkm-ssh-%C"] # %C: hash of the connection, keeps the socket path short
+
+    def run(self, argv, timeout):
+        result = subprocess.run(self.ssh + [self.host, "--", shlex.join(argv)],
+                                capture_output=True, text=True, timeout=timeout)
+        return result.returncode, result.stdout, result.stderr
+
+
+class FakeHostTransport:
+    """
+    Answers commands from a JSON file instead of a real host, to exercise fleet mode without
+    a network. The file maps hosts to the output of each command line:
+        {"web1": {"rpm -q kernel": {"stdout": "kernel-6.5.6-300.fc39.x86_64\\n", "rc": 0},
+                  "uname -r": {"stdout": "6.5.6-300.fc39.x86_64\\n"}, "delay": 0.1}}
+    Unknown commands fail with status 127; an optional "delay" (seconds) applies to every command.
+    """
+    def __init__(self, host, hosts):
+        self.host = host
+        self.commands = hosts.get(host)
+
+    def run(self, argv, timeout):
+        if self.commands is None:
+            return 255, "", f"ssh: Could not resolve hostname {self.host}"
+        delay = self.commands.get("delay", 0)
+        if delay > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired(argv, timeout)
+        time.sleep(delay)
+        answer = self.commands.get(shlex.join(argv))
+        if answer is None:
+            return 127, "", f"{argv[0]}: command not found"
+        return answer.get("rc", 0), answer.get("stdout", ""), answer.get("stderr", "")
+
+
+class FleetHost:
+    """One host of a fleet run: runs commands through its transport within the host deadline."""
+    def __init__(self, transport, timeout, sudo=True):
+        self.transport = transport
+        self.deadline = time.monotonic() + timeout
+        self.sudo = sudo
+
+    def run(self, argv, privileged=False):
+        if privileged and self.sudo:
+            argv = ["sudo", "-n"] + argv # Never prompt: fail instead
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(argv, 0)
+        rc, stdout, stderr = self.transport.run(argv, remaining)
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, argv, stdout, stderr)
+        return stdout
+
+    def lines(self, argv, privileged=False):
+        return [l.strip() for l in self.run(argv, privileged).splitlines() if l.strip()]
+
+
+def _fleet_list(host, kernel):
+    return {"running": host.run(["uname", "-r"]).strip(), "kernels": host.lines(["rpm", "-q", "kernel"])}
+
+
+def _fleet_preview_old(host, kernel):
+    return {"removable": host.lines(["dnf", "repoquery", "--installonly", "--latest-limit=-1", "-q"])}
+
+
+def _fleet_remove_old(host, kernel):
+    removable = _fleet_preview_old(host, kernel)["removable"]
+    if removable:
+        host.run(["dnf", "remove", "-y"] + removable, privileged=True)
+    return {"removed": removable}
+
+
+def _fleet_set_default(host, kernel):
+    if not kernel:
+        raise ValueError("set-default needs --kernel VERSION")
+    host.run(["grubby", "--set-default", f"/boot/vmlinuz-{kernel}"], privileged=True)
+    return {"default": kernel}
+
+
+def _fleet_regenerate_grub(host, kernel):
+    host.run(["grub2-mkconfig", "-o", "/boot/grub2/grub.cfg"], privileged=True)
+    return {}
+
+
+FLEET_OPERATIONS = {
+    "list": _fleet_list,
+    "preview-old": _fleet_preview_old,
+    "remove-old": _fleet_remove_old,
+    "set-default": _fleet_set_default,
+    "regenerate-grub": _fleet_regenerate_grub,
+}
+
+
+def run_fleet(hosts, operation, transport_factory, parallel=8, timeout=120, kernel=None, sudo=True):
+    """
+    Runs a FLEET_OPERATIONS entry on every host, at most 'parallel' hosts at a time and each
+    within 'timeout' seconds. Returns [{"host", "ok", "seconds", "result" | "error"}] in host order.
+    """
+    def _run_host(name):
+        started = time.monotonic()
+        entry = {"host": name}
+        try:
+            host = FleetHost(transport_factory(name), timeout, sudo=sudo)
+            entry["result"] = FLEET_OPERATIONS[operation](host, kernel)
+            entry["ok"] = True
+        except subprocess.TimeoutExpired:
+            entry.update(ok=False, error=f"timed out after {timeout}s")
+        except subprocess.CalledProcessError as e:
+            details = (e.stderr or e.stdout or "").strip().splitlines()
+            entry.update(ok=False, error=f"{shlex.join(e.cmd)}: exit {e.returncode}" + (f": {details[-1]}" if details else ""))
+        except (OSError, ValueError) as e:
+            entry.update(ok=False, error=str(e))
+        entry["seconds"] = round(time.monotonic() - started, 2)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        return list(executor.map(_run_host, hosts))
+
+
+def _fleet_summary(result):
+    """One-line summary of a host's result for the table output."""
+    if not result.get("ok"):
+        return result.get("error", "")
+    data = result.get("result", {})
+    if "kernels" in data:
+        return f"running {data['running']}; " + ", ".join(data["kernels"])
+    if "removable" in data:
+        return ", ".join(data["removable"]) or "nothing to remove"
+    if "removed" in data:
+        return ("removed " + ", ".join(data["removed"])) if data["removed"] else "nothing to remove"
+    if "default" in data:
+        return f"default set to {data['default']}"
+    return "done"
+
+
+class RefreshCoordinator:
+    """
+    Coalesces refresh requests. Requests arriving within 'delay_ms' of each other are debounced
+    into one refresh. A request made while a refresh is running schedules one trailing refresh
+    after it (the running one may have read the state before the change being reported), however
+    many requests arrive meanwhile. 'start_refresh(done)' must start the refresh asynchronously
+    and call 'done(success, result)' on the GLib main loop. request() may be called from any thread.
+    """
+    def __init__(self, start_refresh, delay_ms=200):
+        self.start_refresh = start_refresh
+        self.delay_ms = delay_ms
+        self._timer_id = None
+        self._running = False
+        self._pending = False # A request arrived while a refresh was running
+
+    def request(self):
+        GLib.idle_add(self._request)
+
+    def _request(self):
+        if self._running:
+            self._pending = True
+            return False
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+        self._timer_id = GLib.timeout_add(self.delay_ms, self._start)
+        return False
+
+    def _start(self):
+        self._timer_id = None
+        self._running = True
+        self.start_refresh(self._finished)
+        return False
+
+    def _finished(self, success, result):
+        self._running = False
+        if self._pending:
+            self._pending = False
+            self._request()
+        return False
+
+
+def run_gui():
+    """
+    Imports GTK 3, then shows the main window. The command-line modes (collector, fleet, verify,
+    D-Bus service) never get here, so they also run on hosts without GTK.
+    """
+    import gi
+    gi.require_version('Gtk', '3.0')
+    # Note: Notify is not imported as desktop notifications are replaced by in-app indicators.
+    # If you still see Notify warnings, ensure your local file matches this Canvas.
+    from gi.repository import Gtk, Gdk
+
+    class KernelManager(Gtk.Window):
+        def __init__(self):
+            Gtk.Window.__init__(self, title="Fedora Kernel Manager")
+            self.set_border_width(10)
+            self.set_default_size(1200, 700)
+
+            # --- UI Elements ---
+            self.liststore = Gtk.ListStore(str)
+            self.treeview = Gtk.TreeView(model=self.liststore)
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn("Installed Kernels", renderer, text=0)
+            self.treeview.append_column(column)
+            self.selection = self.treeview.get_selection()
+            self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
+
+            # Terminal-style text area for command output
+            self.terminal_buffer = Gtk.TextBuffer()
+            self.terminal_view = Gtk.TextView(buffer=self.terminal_buffer)
+            self.terminal_view.set_editable(False)
+            self.terminal_view.set_monospace(True)
+            self.terminal_view.set_cursor_visible(True)
+            self.terminal_view.set_name("terminal-output")
+            self.terminal_view.set_can_focus(True)
+
+            # Directly override background and text color for the terminal view
+            # This is the most robust way to ensure the desired colors,
+            # although override_background_color/override_color are deprecated in newer GTK versions.
+            terminal_bg_color = Gdk.RGBA(0, 0, 0, 1)  # Black
+            terminal_text_color = Gdk.RGBA(0, 1, 0, 1) # Green
+            self.terminal_view.override_background_color(Gtk.StateFlags.NORMAL, terminal_bg_color)
+            self.terminal_view.override_color(Gtk.StateFlags.NORMAL, terminal_text_color)
+
+            # Combined treeview and terminal in a vertical paned
+            self.vertical_content_paned = Gtk.Paned(orientation=Gtk.Orientation.VERTICAL)
+            self.vertical_content_paned.set_vexpand(True)
+            self.vertical_content_paned.set_hexpand(True)
+
+            scrollable_treelist = Gtk.ScrolledWindow()
+            scrollable_treelist.set_hexpand(True)
+            scrollable_treelist.set_vexpand(True)
+            scrollable_treelist.add(self.treeview)
+            self.vertical_content_paned.pack1(scrollable_treelist, resize=True, shrink=False)
+
+            terminal_scroll = Gtk.ScrolledWindow()
+            terminal_scroll.set_hexpand(True)
+            terminal_scroll.set_vexpand(True)
+            terminal_scroll.add(self.terminal_view)
+            self.vertical_content_paned.pack2(terminal_scroll, resize=True, shrink=False)
+
+            self.connect("show", self.on_window_show)
+
+            self.spinner = Gtk.Spinner()
+            self.spinner.set_halign(Gtk.Align.CENTER)
+            self.spinner.set_valign(Gtk.Align.CENTER)
+
+            # --- In-app Status Indicator ---
+            self.status_label = Gtk.Label()
+            self.status_label.set_halign(Gtk.Align.CENTER)
+            self.status_label.set_vexpand(False)
+            self.status_label.set_hexpand(False)
+            self.update_status_indicator("idle") # Set initial status
+
+            # --- Buttons ---
+            self.buttons_data = [
+                # Kernel Management
+                ("📋 عرض الأنوية", self.refresh_kernel_list),
+                ("💡 الكيرنل الحالي", self.show_current_kernel),
+                ("⭐ تعيين كيرنل افتراضي", self.set_default_kernel),
+                ("❌ حذف المحدد", self.remove_kernels),
+                ("🔎 عرض الأنوية القابلة للحذف", self.preview_old_kernels),
+                ("🧹 حذف الأنوية القديمة", self.remove_old_kernels),
+                ("🔍 تفاصيل النواة المحددة", self.show_selected_kernel_details_button),
+                ("⏱️ سجل أداء الإقلاع", self.show_boot_history),
+                ("🧬 فحص initramfs", self.inspect_initramfs),
+                ("🛡️ التحقق من سلامة الأنوية", self.verify_kernels),
+
+                # Rescue Kernel Management
+                ("♻️ تحديث نواة rescue", self.update_rescue_kernel),
+                ("📁 عرض ملفات rescue", self.show_rescue_files),
+                ("🗑️ إزالة rescue القديمة", self.remove_old_rescue),
+                ("🧩 تقرير صور النواة اليتيمة", self.show_orphan_kernel_images),
+
+                # GRUB & System Management
+                ("🔄 توليد grub جديد", self.regenerate_grub),
+                ("⚙️ عرض إعدادات Grub", self.show_grub_settings),
+                ("🧾 تحرير معاملات النواة", self.edit_kernel_cmdline),
+                ("🎛️ تعيين إدخال تمهيد افتراضي", self.set_default_boot_entry_by_index),
+                ("📊 عرض معلومات النظام", self.show_system_info),
+                ("⚙️ إدارة إعدادات DNF و Grub", self.manage_dnf_settings),
+                ("📸 إنشاء لقطة Btrfs", self.create_btrfs_snapshot),
+                ("🧼 Clear الشاشة", self.clear_screen),
+                ("📋 نسخ مخرج الطرفية", self.copy_terminal_output),
+                ("❓ حول البرنامج", self.show_about_dialog)
+            ]
+
+            # --- Button Styling ---
+            css = b"""
+            button {
+                background-color: #fff176; /* Yellowish background */
+                font-weight: bold;
+                padding: 6px; /* Reduced padding for smaller buttons */
+                border-radius: 5px; /* Rounded corners for buttons */
+                box-shadow: 2px 2px 5px rgba(0, 0, 0, 0.2); /* Subtle shadow */
+            }
+            button:hover {
+                background-color: #ffe082; /* Lighter yellow on hover */
+            }
+            button:active {
+                background-color: #ffca28; /* Darker yellow when pressed */
+                box-shadow: inset 1px 1px 3px rgba(0, 0, 0, 0.3); /* Inset shadow for pressed state */
+            }
+            """
+            style_provider = Gtk.CssProvider()
+            style_provider.load_from_data(css)
+            screen = Gdk.Screen.get_default()
+            if screen:
+                Gtk.StyleContext.add_provider_for_screen(
+                    screen, style_provider,
+                    Gtk.STYLE_PROVIDER_PRIORITY_USER
+                )
+
+            # --- Layout ---
+            grid = Gtk.Grid(column_spacing=10, row_spacing=10)
+            self.action_buttons = []
+            for i, (label, callback) in enumerate(self.buttons_data):
+                btn = Gtk.Button(label=label)
+                btn.connect("clicked", callback)
+                grid.attach(btn, i % 2, i // 2, 1, 1) # 2 columns for buttons
+                self.action_buttons.append(btn)
+
+            right_panel_vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+            right_panel_vbox.pack_start(grid, False, False, 0)
+            right_panel_vbox.pack_start(self.spinner, False, False, 0)
+            right_panel_vbox.pack_start(self.status_label, False, False, 0) # Add status label here
+
+            # Main horizontal box: vertical_content_paned | right_panel_vbox
+            main_hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+
+            # The left panel now only contains the vertical_content_paned (kernel list + terminal)
+            main_hbox.pack_start(self.vertical_content_paned, True, True, 0)
+            main_hbox.pack_start(right_panel_vbox, False, False, 0)
+
+            self.add(main_hbox)
+
+            # Cached kernel state, also published on the session bus for other tools
+            self.kernel_state = KernelState()
+            self.kernel_state.add_listener(lambda state: GLib.idle_add(self._update_kernel_list))
+            # Every refresh request (buttons, startup, end of operations, D-Bus Refresh) goes through the coordinator
+            self.refresh_coordinator = RefreshCoordinator(self._run_state_refresh)
+            start_dbus_service(self.kernel_state, coordinator=self.refresh_coordinator)
+
+        def update_status_indicator(self, status_type, message=""):
+            """Updates the in-app status indicator (icon/text)."""
+            if status_type == "running":
+                self.status_label.set_markup(f"<span foreground='#FFD700'>🔄 {message if message else 'جارٍ التنفيذ...'}</span>")
+            elif status_type == "success":
+                self.status_label.set_markup(f"<span foreground='#32CD32'>✅ {message if message else 'اكتمل بنجاح'}</span>")
+            elif status_type == "error":
+                self.status_label.set_markup(f"<span foreground='#FF4500'>❌ {message if message else 'فشل!'}</span>")
+            else: # idle
+                self.status_label.set_markup("<span foreground='#808080'>Idle</span>")
+
+        def show_selected_kernel_details_button(self, widget):
+            """Callback for the 'Show Selected Kernel Details' button."""
+            selected_kernels = self.get_selected_kernels()
+            if not selected_kernels:
+                self.show_info("الرجاء تحديد نواة لعرض تفاصيلها.")
+                return
+
+            # Only show details for the first selected kernel if multiple are selected
+            kernel_name = selected_kernels[0]
+            self._show_kernel_details_in_dialog(kernel_name)
+
+        def _show_kernel_details_in_dialog(self, kernel_name):
+            """Fetches and displays detailed information for the selected kernel in a dialog."""
+            def _callback(success, output):
+                # Using keyword arguments for Gtk.MessageDialog constructor
+                dialog = Gtk.MessageDialog(
+                    parent=self,
+                    modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                    message_type=Gtk.MessageType.INFO,
+                    buttons=Gtk.ButtonsType.OK, # This is fine for MessageDialog
+                    text=f"تفاصيل النواة: {kernel_name}"
+                )
+
+                if success and output:
+                    dialog.format_secondary_text(output) # Reverted to format_secondary_text
                 else:
-                    error_details = result.stderr.strip() if result.stderr else result.stdout.strip() if result.stdout else f"الرمز: {result.returncode}"
+                    dialog.format_secondary_text(f"تعذر الحصول على تفاصيل النواة: {kernel_name}\n\nيرجى التحقق من سجل الطرفية لمزيد من التفاصيل.")
+
+                dialog.set_default_size(600, 400) # Set a reasonable size for the dialog
+                dialog.run()
+                dialog.destroy()
+
+            # rpm -qi provides detailed info about installed package
+            self.run_command_async(["rpm", "-qi", kernel_name],
+                                   show_output=True,
+                                   error_msg=f"فشل الحصول على تفاصيل {kernel_name}.",
+                                   callback=_callback)
+
+        def on_window_show(self, widget):
+            # Set initial position for main content paned (kernel list & terminal)
+            total_height = self.vertical_content_paned.get_allocation().height
+            self.vertical_content_paned.set_position(total_height // 4)
+
+            self.refresh_kernel_list(None) # Automatically refresh kernel list on startup
+
+        def log_terminal(self, text):
+            """Appends text to the terminal output area and scrolls to the end."""
+            end_iter = self.terminal_buffer.get_end_iter()
+            self.terminal_buffer.insert(end_iter, text)
+            self.terminal_view.scroll_mark_onscreen(self.terminal_buffer.get_insert())
+
+        def set_buttons_sensitive(self, sensitive):
+            """Sets the sensitivity of all action buttons."""
+            for btn in self.action_buttons:
+                if btn.get_label() != "🧼 Clear الشاشة": # Keep Clear Screen sensitive
+                    btn.set_sensitive(sensitive)
+
+        def run_command_async(self, cmd, error_msg="حدث خطأ.", show_output=False, use_shell=False, callback=None, raise_on_error=True, input_data=None,
+                              operation=None):
+            """
+            Runs a shell command asynchronously in a separate thread.
+            Logs STDOUT and STDERR to the terminal view.
+            Updates in-app status indicator.
+            'raise_on_error': If False, a non-zero exit code will not raise CalledProcessError,
+                              but 'success' in callback will be False. Useful for commands like 'grep'.
+            'input_data': Optional text passed to the command on stdin.
+            'operation': Name recorded for a pkexec command (for the collector) when the command
+                         itself does not say it, e.g. a 'pkexec sh -c ...' script.
+            """
+            self.spinner.start()
+            self.set_buttons_sensitive(False)
+            self.update_status_indicator("running", "جارٍ التنفيذ...") # Set status to running
+
+            def _run():
+                success = False
+                output = None
+                started = time.monotonic()
+                try:
+                    if use_shell:
+                        cmd_str = ' '.join(cmd) if isinstance(cmd, list) else cmd
+                    else:
+                        cmd_list = cmd.split() if isinstance(cmd, str) else cmd
+
+                    GLib.idle_add(self.log_terminal, f"\n$ {cmd_str if use_shell else ' '.join(cmd_list)}\n")
+
+                    result = subprocess.run(cmd_list if not use_shell else cmd_str,
+                                            capture_output=True, text=True, check=raise_on_error, shell=use_shell,
+                                            input=input_data)
+
+                    if result.stdout:
+                        GLib.idle_add(self.log_terminal, f"STDOUT:\n{result.stdout.strip()}\n")
+                    if result.stderr:
+                        GLib.idle_add(self.log_terminal, f"STDERR:\n{result.stderr.strip()}\n")
+
+                    if show_output:
+                        output = result.stdout.strip()
+
+                    # Determine success based on return code if raise_on_error is False
+                    if not raise_on_error and result.returncode != 0:
+                        success = False
+                        GLib.idle_add(self.log_terminal, f"Command exited with non-zero status: {result.returncode}\n")
+                    else:
+                        success = True
+
+                    if success:
+                        self.update_status_indicator("success", "اكتمل بنجاح")
+                    else:
+                        error_details = result.stderr.strip() if result.stderr else result.stdout.strip() if result.stdout else f"الرمز: {result.returncode}"
+                        self.update_status_indicator("error", "فشل!")
+                        GLib.idle_add(self.show_error, f"{error_msg}\nالخطأ: {error_details}")
+
+                except subprocess.CalledProcessError as e:
+                    if e.stdout:
+                        GLib.idle_add(self.log_terminal, f"ERROR STDOUT:\n{e.stdout.strip()}\n")
+                    if e.stderr:
+                        GLib.idle_add(self.log_terminal, f"ERROR STDERR:\n{e.stderr.strip()}\n")
+                    error_details = e.stderr.strip() if e.stderr else e.stdout.strip() if e.stdout else "خطأ غير معروف."
                     self.update_status_indicator("error", "فشل!")
                     GLib.idle_add(self.show_error, f"{error_msg}\nالخطأ: {error_details}")
+                except FileNotFoundError:
+                    self.update_status_indicator("error", "فشل!")
+                    GLib.idle_add(self.show_error, f"الأمر غير موجود أو حدث خطأ في المسار.")
+                finally:
+                    GLib.idle_add(self.spinner.stop)
+                    GLib.idle_add(self.set_buttons_sensitive, True)
+                    if isinstance(cmd, list) and cmd and cmd[0] == "pkexec":
+                        record_operation(operation or operation_name(cmd), time.monotonic() - started, success)
+                    if callback:
+                        callback(success, output)
+
+            threading.Thread(target=_run).start()
+
+        def run_task_async(self, func, error_msg="حدث خطأ.", callback=None, lock_buttons=True):
+            """
+            Runs a Python callable in a separate thread, with the same spinner/status handling
+            as run_command_async. 'callback(success, result)' is called on the GTK main loop.
+            'lock_buttons': If False, the action buttons stay sensitive (for background refreshes).
+            """
+            self.spinner.start()
+            if lock_buttons:
+                self.set_buttons_sensitive(False)
+            self.update_status_indicator("running", "جارٍ التنفيذ...")
+
+            def _log(text):
+                GLib.idle_add(self.log_terminal, text)
+
+            def _run():
+                success = False
+                result = None
+                try:
+                    result = func(_log)
+                    success = True
+                    GLib.idle_add(self.update_status_indicator, "success", "اكتمل بنجاح")
+                except (OSError, subprocess.SubprocessError, ValueError) as e:
+                    _log(f"ERROR: {e}\n")
+                    GLib.idle_add(self.update_status_indicator, "error", "فشل!")
+                    GLib.idle_add(self.show_error, f"{error_msg}\nالخطأ: {e}")
+                finally:
+                    GLib.idle_add(self.spinner.stop)
+                    if lock_buttons:
+                        GLib.idle_add(self.set_buttons_sensitive, True)
+                    if callback:
+                        GLib.idle_add(callback, success, result)
+
+            threading.Thread(target=_run).start()
+
+        def _show_table_dialog(self, title, columns, rows, width=800, height=400):
+            """Shows rows of strings in a read-only, sortable table dialog."""
+            dialog = Gtk.Dialog(
+                title=title,
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                destroy_with_parent=True
+            )
+            dialog.set_default_size(width, height)
 
-            except subprocess.CalledProcessError as e:
-                if e.stdout:
-                    GLib.idle_add(self.log_terminal, f"ERROR STDOUT:\n{e.stdout.strip()}\n")
-                if e.stderr:
-                    GLib.idle_add(self.log_terminal, f"ERROR STDERR:\n{e.stderr.strip()}\n")
-                error_details = e.stderr.strip() if e.stderr else e.stdout.strip() if e.stdout else "خطأ غير معروف."
-                self.update_status_indicator("error", "فشل!")
-                GLib.idle_add(self.show_error, f"{error_msg}\nالخطأ: {error_details}")
-            except FileNotFoundError:
-                self.update_status_indicator("error", "فشل!")
-                GLib.idle_add(self.show_error, f"الأمر غير موجود أو حدث خطأ في المسار.")
-            finally:
-                GLib.idle_add(self.spinner.stop)
-                GLib.idle_add(self.set_buttons_sensitive, True)
-                if callback:
-                    callback(success, output)
-
-        threading.Thread(target=_run).start()
-
-    def get_selected_kernels(self):
-        model, paths = self.selection.get_selected_rows()
-        return [model.get_value(model.get_iter(path), 0) for path in paths]
-
-    def refresh_kernel_list(self, widget):
-        self.run_command_async(["rpm", "-q", "kernel"],
-                               error_msg="فشل عرض قائمة الأنوية.",
-                               show_output=True,
-                               use_shell=False,
-                               callback=lambda s, o: (self.liststore.clear(), [self.liststore.append([line.strip()]) for line in o.splitlines()]) if s and o else None)
-
-    def show_current_kernel(self, widget):
-        self.run_command_async(["/usr/bin/uname", "-r"],
-                               show_output=True,
-                               error_msg="فشل عرض النواة الحالية.",
-                               callback=lambda s, o: self.show_info(f"النواة الحالية:\n{o}") if s and o else self.show_info("تعذر الحصول على النواة الحالية أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل."))
-
-    def set_default_kernel(self, widget):
-        selected = self.get_selected_kernels()
-        if not selected:
-            self.show_info("الرجاء تحديد كيرنل لتعيينه كافتراضي.")
-            return
-        if len(selected) > 1:
-            self.show_info("الرجاء تحديد كيرنل واحد فقط لتعيينه كافتراضي.")
-            return
+            liststore = Gtk.ListStore(*([str] * len(columns)))
+            for row in rows:
+                liststore.append(["" if v is None else str(v) for v in row])
 
-        kernel = selected[0]
-        version = kernel.replace("kernel-", "")
-        path = f"/boot/vmlinuz-{version}" # Path to the kernel vmlinuz file
-
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO,
-            text="هل تريد تعيين هذا الكيرنل كافتراضي؟",
-            secondary_text=f"سيتم تعيين '{kernel}' كيرنل افتراضي. ستحتاج إلى إعادة تشغيل النظام لتطبيق التغيير."
-        )
-        response = dialog.run()
-        dialog.destroy()
-
-        if response == Gtk.ResponseType.YES:
-            self.run_command_async(["pkexec", "grubby", "--set-default", path],
-                                   error_msg="فشل تعيين الكيرنل الافتراضي.",
-                                   show_output=False,
-                                   use_shell=False,
-                                   callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم تعيين الكيرنل الافتراضي بنجاح. أعد تشغيل النظام لتطبيق التغييرات.")) if s else None)
+            treeview = Gtk.TreeView(model=liststore)
+            for i, column_title in enumerate(columns):
+                column = Gtk.TreeViewColumn(column_title, Gtk.CellRendererText(), text=i)
+                column.set_sort_column_id(i)
+                column.set_resizable(True)
+                treeview.append_column(column)
 
-    def remove_kernels(self, widget):
-        kernels = self.get_selected_kernels()
-        if not kernels:
-            self.show_info("الرجاء تحديد أنوية لحذفها.")
-            return
+            scrollable = Gtk.ScrolledWindow()
+            scrollable.set_vexpand(True)
+            scrollable.add(treeview)
+            dialog.get_content_area().pack_start(scrollable, True, True, 5)
+            dialog.add_buttons(Gtk.STOCK_OK, Gtk.ResponseType.OK)
+            dialog.show_all()
+            dialog.run()
+            dialog.destroy()
 
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO,
-            text="هل تريد حذف الأنوية المحددة؟",
-            secondary_text="قد يؤثر حذف الأنوية على استقرار النظام.\n\n" + "\n".join(kernels)
-        )
-        response = dialog.run()
-        dialog.destroy()
-
-        if response == Gtk.ResponseType.YES:
-            self.run_command_async(["pkexec", "dnf", "remove", "-y"] + kernels,
-                                   error_msg="فشل حذف الأنوية.",
-                                   show_output=False,
-                                   use_shell=False,
-                                   callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم حذف الأنوية بنجاح.")) if s else None)
-
-    def preview_old_kernels(self, widget):
-        self.run_command_async(["dnf", "repoquery", "--installonly", "--latest-limit=-1", "-q"],
-                               show_output=True,
-                               error_msg="فشل عرض الأنوية القابلة للحذف.",
-                               use_shell=False,
-                               callback=lambda s, o: self.show_info("الأنوية القابلة للحذف:\n" + o) if s and o else self.show_info("لا توجد أنوية قديمة قابلة للحذف حاليًا."))
-
-    def remove_old_kernels(self, widget):
-        """
-        Removes old, unused kernels after user confirmation.
-        """
-        def _get_old_kernels_callback(success, output):
-            if not success or not output:
-                self.show_info("لا توجد أنوية قديمة للحذف.")
+        def show_boot_history(self, widget):
+            """Shows boot duration and kernel error counts per past boot and per kernel version."""
+            def _callback(success, records):
+                if not success:
+                    return False
+                if not records:
+                    self.show_info("لا توجد عمليات إقلاع مسجلة في سجل النظام (journal).")
+                    return False
+
+                summary = summarize_boot_history(records)
+                self._show_table_dialog("مقارنة أداء الإقلاع حسب النواة",
+                                        ["النواة", "مرات الإقلاع", "متوسط الإقلاع (ث)", "الأفضل (ث)", "الأسوأ (ث)", "متوسط أخطاء النواة"],
+                                        [[s["kernel"], s["boots"], s["avg_boot_s"], s["best_boot_s"], s["worst_boot_s"], s["avg_errors"]] for s in summary])
+
+                rows = []
+                for record in reversed(records):
+                    boot_s = round(record["boot_usec"] / 1e6, 2) if record.get("boot_usec") else None
+                    rows.append([record["boot_id"], record.get("kernel") or "unknown", boot_s,
+                                 record.get("errors"), record.get("critical")])
+                self._show_table_dialog("سجل أداء الإقلاع",
+                                        ["معرّف الإقلاع", "النواة", "مدة الإقلاع (ث)", "أخطاء النواة", "أخطاء حرجة"],
+                                        rows, width=900)
+                return False
+
+            self.run_task_async(lambda log: collect_boot_history(log=log),
+                                error_msg="فشل قراءة سجل الإقلاع من journal.",
+                                callback=_callback)
+
+        def inspect_initramfs(self, widget):
+            """Lists/searches the contents of an initramfs image, or compares two images."""
+            try:
+                images = list_initramfs_images()
+            except OSError as e:
+                self.show_error(f"تعذر قراءة /boot:\n{e}")
+                return
+            # Images of the selected kernels (if any) plus the rescue images
+            selected = [f"/boot/initramfs-{k.replace('kernel-', '', 1)}.img" for k in self.get_selected_kernels()]
+            selected = [p for p in selected if p in images]
+            if selected:
+                images = selected + [p for p in images if "rescue" in p]
+            if not images:
+                self.show_info("لا توجد صور initramfs في /boot.")
+                return
+
+            dialog = Gtk.Dialog(
+                title="فحص initramfs",
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                destroy_with_parent=True
+            )
+            grid = Gtk.Grid(column_spacing=10, row_spacing=5)
+            combo_a = Gtk.ComboBoxText()
+            combo_b = Gtk.ComboBoxText()
+            combo_b.append_text("—")
+            for image in images:
+                combo_a.append_text(image)
+                combo_b.append_text(image)
+            combo_a.set_active(0)
+            combo_b.set_active(0)
+            grid.attach(Gtk.Label(label="الصورة:", xalign=0), 0, 0, 1, 1)
+            grid.attach(combo_a, 1, 0, 1, 1)
+            grid.attach(Gtk.Label(label="مقارنة مع (اختياري):", xalign=0), 0, 1, 1, 1)
+            grid.attach(combo_b, 1, 1, 1, 1)
+            dialog.get_content_area().pack_start(grid, True, True, 5)
+            dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+            dialog.show_all()
+            response = dialog.run()
+            image_a = combo_a.get_active_text()
+            image_b = combo_b.get_active_text() if combo_b.get_active() > 0 else None
+            dialog.destroy()
+
+            if response != Gtk.ResponseType.OK or not image_a:
+                return
+            if not image_b:
+                self._show_initramfs_dialog(image_a)
+                return
+
+            def _compare(log):
+                return compare_initramfs(list(iter_initramfs_index(image_a, log)),
+                                         list(iter_initramfs_index(image_b, log)))
+
+            def _callback(success, differences):
+                if not success:
+                    return False
+                if not differences:
+                    self.show_info(f"لا توجد فروق بين:\n{image_a}\n{image_b}")
+                    return False
+                labels = {"added": "مضاف", "removed": "محذوف", "changed": "متغير"}
+                self._show_table_dialog(f"الفروق: {os.path.basename(image_a)} ← {os.path.basename(image_b)}",
+                                        ["المسار", "الحالة", "الحجم (1)", "الحجم (2)"],
+                                        [(path, labels.get(status, status), a, b) for path, status, a, b in differences],
+                                        width=900)
+                return False
+
+            self.run_task_async(_compare, error_msg="فشلت مقارنة صور initramfs.", callback=_callback)
+
+        def _show_initramfs_dialog(self, image):
+            """Shows the entries of an initramfs as they are parsed, with a path search box."""
+            dialog = Gtk.Dialog(
+                title=f"محتويات {image}",
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                destroy_with_parent=True
+            )
+            dialog.set_default_size(900, 600)
+            content_area = dialog.get_content_area()
+
+            search_entry = Gtk.SearchEntry(placeholder_text="بحث في المسارات (مثال: nvme أو firmware/iwlwifi)")
+            content_area.pack_start(search_entry, False, False, 5)
+
+            liststore = Gtk.ListStore(str, str, str, str, str) # Path, type, mode, size, link target
+            filtered = liststore.filter_new()
+            filtered.set_visible_func(lambda model, it, data: search_entry.get_text().lower() in (model[it][0] or "").lower())
+            search_entry.connect("search-changed", lambda e: filtered.refilter())
+
+            treeview = Gtk.TreeView(model=filtered)
+            for i, title in enumerate(["المسار", "النوع", "الصلاحيات", "الحجم", "الرابط"]):
+                column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i)
+                column.set_resizable(True)
+                treeview.append_column(column)
+            scrollable = Gtk.ScrolledWindow()
+            scrollable.set_vexpand(True)
+            scrollable.add(treeview)
+            content_area.pack_start(scrollable, True, True, 5)
+
+            status = Gtk.Label(label="جارٍ القراءة...", xalign=0)
+            content_area.pack_start(status, False, False, 5)
+            dialog.add_buttons(Gtk.STOCK_OK, Gtk.ResponseType.OK)
+            dialog.show_all()
+
+            closed = threading.Event()
+
+            def _append(rows, total, done):
+                if closed.is_set():
+                    return False
+                for row in rows:
+                    liststore.append(row)
+                status.set_text(f"{total} إدخال" if done else f"{total} إدخال... جارٍ القراءة")
+                return False
+
+            def _load():
+                batch = []
+                total = 0
+                try:
+                    for path, entry_type, mode, size, mtime, segment, target in iter_initramfs_index(
+                            image, log=lambda t: GLib.idle_add(self.log_terminal, t)):
+                        if closed.is_set():
+                            return
+                        batch.append([path, entry_type, oct(mode), str(size), target])
+                        total += 1
+                        if len(batch) >= 500:
+                            GLib.idle_add(_append, batch, total, False)
+                            batch = []
+                    GLib.idle_add(_append, batch, total, True)
+                except (OSError, ValueError, subprocess.SubprocessError) as e:
+                    GLib.idle_add(self.log_terminal, f"ERROR: {e}\n")
+                    GLib.idle_add(status.set_text, f"فشل قراءة الصورة: {e}")
+
+            threading.Thread(target=_load, daemon=True).start()
+            dialog.run()
+            closed.set()
+            dialog.destroy()
+
+        def verify_kernels(self, widget):
+            """Verifies the files of the selected (or all) kernels against their rpm digests."""
+            versions = [k.replace("kernel-", "", 1) for k in self.get_selected_kernels()]
+
+            def _callback(success, reports):
+                if not success:
+                    return False
+                if not reports:
+                    self.show_info("لم يتم العثور على حزم النواة المحددة.")
+                    return False
+                labels = {"ok": "سليمة", "modified": "معدلة!", "incomplete": "غير مكتملة (ملفات غير مقروءة)"}
+                rows = []
+                for report in reports:
+                    rows.append([report["version"], labels[report["status"]], report["files"], len(report["modified"]),
+                                 len(report["missing"]), len(report["unreadable"]), report["cached"]])
+                self._show_table_dialog("نتيجة التحقق من سلامة الأنوية",
+                                        ["النواة", "الحالة", "الملفات", "معدلة", "مفقودة", "غير مقروءة", "من الذاكرة المؤقتة"],
+                                        rows, width=900)
+                problems = [[r["version"], path, "معدل"] for r in reports for path in r["modified"]]
+                problems += [[r["version"], path, "مفقود"] for r in reports for path in r["missing"]]
+                problems += [[r["version"], path, "غير مقروء (لم يتم التحقق منه)"] for r in reports for path in r["unreadable"]]
+                if problems:
+                    self._show_table_dialog("الملفات المعدلة أو المفقودة أو غير المقروءة", ["النواة", "الملف", "الحالة"], problems, width=900)
+                return False
+
+            self.run_task_async(lambda log: verify_kernels(versions or None, log=log),
+                                error_msg="فشل التحقق من سلامة الأنوية.",
+                                callback=_callback)
+
+        def get_selected_kernels(self):
+            model, paths = self.selection.get_selected_rows()
+            return [model.get_value(model.get_iter(path), 0) for path in paths]
+
+        def refresh_kernel_list(self, widget):
+            """
+            Requests a refresh of the cached kernel state (published on D-Bus) and of the kernel list.
+            Safe to call from worker threads; bursts of requests are merged into a single refresh.
+            """
+            self.refresh_coordinator.request()
+
+        def _run_state_refresh(self, done):
+            """Refreshes the kernel state in a worker thread; 'done(success, state)' runs on the main loop."""
+            self.run_task_async(lambda log: self.kernel_state.refresh(log=log),
+                                error_msg="فشل عرض قائمة الأنوية.",
+                                callback=done,
+                                lock_buttons=False)
+
+        def _update_kernel_list(self):
+            """Shows the installed kernels of the cached state, touching the list only if it changed."""
+            kernels = self.kernel_state.snapshot()["installed"]
+            if [row[0] for row in self.liststore] == kernels:
+                return False
+            selected = set(self.get_selected_kernels())
+            self.liststore.clear()
+            for kernel in kernels:
+                treeiter = self.liststore.append([kernel])
+                if kernel in selected:
+                    self.selection.select_iter(treeiter)
+            return False
+
+        def show_current_kernel(self, widget):
+            self.run_command_async(["/usr/bin/uname", "-r"],
+                                   show_output=True,
+                                   error_msg="فشل عرض النواة الحالية.",
+                                   callback=lambda s, o: self.show_info(f"النواة الحالية:\n{o}") if s and o else self.show_info("تعذر الحصول على النواة الحالية أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل."))
+
+        def set_default_kernel(self, widget):
+            selected = self.get_selected_kernels()
+            if not selected:
+                self.show_info("الرجاء تحديد كيرنل لتعيينه كافتراضي.")
+                return
+            if len(selected) > 1:
+                self.show_info("الرجاء تحديد كيرنل واحد فقط لتعيينه كافتراضي.")
                 return
 
-            kernels_to_remove = output.splitlines()
+            kernel = selected[0]
+            version = kernel.replace("kernel-", "", 1)
+            try:
+                # The image whose header carries this version, even if the file was renamed
+                path = find_kernel_image(version)
+            except OSError:
+                path = f"/boot/vmlinuz-{version}" # Path to the kernel vmlinuz file
+
             # Using keyword arguments for Gtk.MessageDialog constructor
             dialog = Gtk.MessageDialog(
                 parent=self,
                 modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
                 message_type=Gtk.MessageType.QUESTION,
                 buttons=Gtk.ButtonsType.YES_NO,
-                text="هل تريد حذف الأنوية القديمة؟",
-                secondary_text="قد يؤثر حذف الأنوية القديمة على خيارات التمهيد.\n\n" + "\n".join(kernels_to_remove)
+                text="هل تريد تعيين هذا الكيرنل كافتراضي؟",
+                secondary_text=f"سيتم تعيين '{kernel}' كيرنل افتراضي. ستحتاج إلى إعادة تشغيل النظام لتطبيق التغيير."
             )
             response = dialog.run()
             dialog.destroy()
 
             if response == Gtk.ResponseType.YES:
-                self.run_command_async(["pkexec", "dnf", "remove", "-y"] + kernels_to_remove,
-                                       error_msg="فشل حذف الأنوية القديمة.",
+                self.run_command_async(["pkexec", "grubby", "--set-default", path],
+                                       error_msg="فشل تعيين الكيرنل الافتراضي.",
                                        show_output=False,
                                        use_shell=False,
-                                       callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم حذف الأنوية بنجاح.")) if s else None)
+                                       callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم تعيين الكيرنل الافتراضي بنجاح. أعد تشغيل النظام لتطبيق التغييرات.")) if s else None)
 
-        self.run_command_async(["dnf", "repoquery", "--installonly", "--latest-limit=-1", "-q"],
-                               show_output=True,
-                               use_shell=False,
-                               callback=_get_old_kernels_callback)
-
-    def clear_screen(self, widget):
-        self.terminal_buffer.set_text("")
-        self.liststore.clear()
-        self.update_status_indicator("idle") # Reset status on clear screen
-
-    def copy_terminal_output(self, widget):
-        """Copies the entire content of the terminal output to the clipboard."""
-        text = self.terminal_buffer.get_text(
-            self.terminal_buffer.get_start_iter(),
-            self.terminal_buffer.get_end_iter(),
-            True
-        )
-        clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-        clipboard.set_text(text, -1) # -1 means length is unknown, Gtk will calculate it
-        self.show_info("تم نسخ مخرج الطرفية إلى الحافظة.")
-        self.update_status_indicator("success", "تم نسخ مخرج الطرفية.")
-
-    def show_grub_settings(self, widget):
-        """Displays the current GRUB settings using grubby --info ALL."""
-        self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
-                               show_output=True,
-                               error_msg="فشل عرض إعدادات Grub. قد تحتاج إلى صلاحيات الجذر.",
-                               use_shell=False,
-                               callback=lambda s, o: self.show_info(f"إعدادات Grub:\n{o}") if s and o else self.show_info("تعذر الحصول على إعدادات Grub أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل."))
-
-    def show_grub_boot_entries(self, widget):
-        """Displays a list of GRUB boot entry titles."""
-        def _callback(success, output):
-            if not success or not output:
-                self.show_info("تعذر الحصول على إدخالات التمهيد أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل.")
+        def remove_kernels(self, widget):
+            kernels = self.get_selected_kernels()
+            if not kernels:
+                self.show_info("الرجاء تحديد أنوية لحذفها.")
                 return
 
-            titles = []
-            for line in output.splitlines():
-                if line.startswith("title="):
-                    titles.append(line.replace("title=", "").strip())
-            
-            if titles:
-                self.show_info("إدخالات التمهيد (Grub Entries):\n" + "\n".join(titles))
-            else:
-                self.show_info("لم يتم العثور على إدخالات تمهيد في مخرجات Grub.")
-            self.update_status_indicator("success", "تم عرض إدخالات التمهيد.")
-
-        self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
-                               show_output=True,
-                               error_msg="فشل عرض إدخالات التمهيد. قد تحتاج إلى صلاحيات الجذر.",
-                               use_shell=False,
-                               callback=_callback)
-
-    def set_default_boot_entry_by_index(self, widget):
-        """Allows user to set a default GRUB boot entry by index."""
-        def _get_entries_callback(success, output):
-            if not success or not output:
-                self.show_error("تعذر الحصول على إدخالات التمهيد لتعيين الافتراضي.")
-                return
+            # Using keyword arguments for Gtk.MessageDialog constructor
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                message_type=Gtk.MessageType.QUESTION,
+                buttons=Gtk.ButtonsType.YES_NO,
+                text="هل تريد حذف الأنوية المحددة؟",
+                secondary_text="قد يؤثر حذف الأنوية على استقرار النظام.\n\n" + "\n".join(kernels)
+            )
+            response = dialog.run()
+            dialog.destroy()
 
-            entries = [] # Stores (index, title)
-            current_index = -1
-            current_title = ""
-            
-            for line in output.splitlines():
-                if line.startswith("index="):
-                    # If we processed a previous entry, add it to list
-                    if current_title:
-                        entries.append((str(current_index), current_title))
-                    current_index = int(line.replace("index=", "").strip())
-                    current_title = "" # Reset title for new entry
-                elif line.startswith("title="):
-                    current_title = line.replace("title=", "").strip()
-            
-            # Add the last entry after loop finishes
-            if current_title:
-                entries.append((str(current_index), current_title))
-
-
-            if not entries:
-                self.show_info("لا توجد إدخالات تمهيد متاحة لتعيينها كافتراضي.")
-                return
+            if response == Gtk.ResponseType.YES:
+                self.run_command_async(["pkexec", "dnf", "remove", "-y"] + kernels,
+                                       error_msg="فشل حذف الأنوية.",
+                                       show_output=False,
+                                       use_shell=False,
+                                       callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم حذف الأنوية بنجاح.")) if s else None)
 
-            # Create a dialog to select the index
-            # Using keyword arguments for Gtk.Dialog constructor and add_buttons method
+        def preview_old_kernels(self, widget):
+            self.run_command_async(["dnf", "repoquery", "--installonly", "--latest-limit=-1", "-q"],
+                                   show_output=True,
+                                   error_msg="فشل عرض الأنوية القابلة للحذف.",
+                                   use_shell=False,
+                                   callback=lambda s, o: self.show_info("الأنوية القابلة للحذف:\n" + o) if s and o else self.show_info("لا توجد أنوية قديمة قابلة للحذف حاليًا."))
+
+        def remove_old_kernels(self, widget):
+            """
+            Removes old, unused kernels after user confirmation.
+            """
+            def _get_old_kernels_callback(success, output):
+                if not success or not output:
+                    self.show_info("لا توجد أنوية قديمة للحذف.")
+                    return
+
+                kernels_to_remove = output.splitlines()
+                # Using keyword arguments for Gtk.MessageDialog constructor
+                dialog = Gtk.MessageDialog(
+                    parent=self,
+                    modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                    message_type=Gtk.MessageType.QUESTION,
+                    buttons=Gtk.ButtonsType.YES_NO,
+                    text="هل تريد حذف الأنوية القديمة؟",
+                    secondary_text="قد يؤثر حذف الأنوية القديمة على خيارات التمهيد.\n\n" + "\n".join(kernels_to_remove)
+                )
+                response = dialog.run()
+                dialog.destroy()
+
+                if response == Gtk.ResponseType.YES:
+                    self.run_command_async(["pkexec", "dnf", "remove", "-y"] + kernels_to_remove,
+                                           error_msg="فشل حذف الأنوية القديمة.",
+                                           show_output=False,
+                                           use_shell=False,
+                                           callback=lambda s, o: (self.refresh_kernel_list(None), self.show_info("تم حذف الأنوية بنجاح.")) if s else None)
+
+            self.run_command_async(["dnf", "repoquery", "--installonly", "--latest-limit=-1", "-q"],
+                                   show_output=True,
+                                   use_shell=False,
+                                   callback=_get_old_kernels_callback)
+
+        def clear_screen(self, widget):
+            self.terminal_buffer.set_text("")
+            self.liststore.clear()
+            self.update_status_indicator("idle") # Reset status on clear screen
+
+        def copy_terminal_output(self, widget):
+            """Copies the entire content of the terminal output to the clipboard."""
+            text = self.terminal_buffer.get_text(
+                self.terminal_buffer.get_start_iter(),
+                self.terminal_buffer.get_end_iter(),
+                True
+            )
+            clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+            clipboard.set_text(text, -1) # -1 means length is unknown, Gtk will calculate it
+            self.show_info("تم نسخ مخرج الطرفية إلى الحافظة.")
+            self.update_status_indicator("success", "تم نسخ مخرج الطرفية.")
+
+        def show_grub_settings(self, widget):
+            """Displays the current GRUB settings using grubby --info ALL."""
+            self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
+                                   show_output=True,
+                                   error_msg="فشل عرض إعدادات Grub. قد تحتاج إلى صلاحيات الجذر.",
+                                   use_shell=False,
+                                   callback=lambda s, o: self.show_info(f"إعدادات Grub:\n{o}") if s and o else self.show_info("تعذر الحصول على إعدادات Grub أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل."))
+
+        def edit_kernel_cmdline(self, widget):
+            """Adds/removes kernel arguments on a chosen subset of BLS boot entries in one batch."""
+            def _callback(success, entries):
+                if not success:
+                    return False
+                editable = [e for e in entries if not e.uses_grubenv]
+                for entry in entries:
+                    if entry.uses_grubenv:
+                        self.log_terminal(f"Skipping {entry.path}: options come from $kernelopts in grubenv.\n")
+                if not editable:
+                    self.show_info("لا توجد إدخالات تمهيد قابلة للتحرير في " + BLS_ENTRIES_DIR)
+                    return False
+                self._run_cmdline_editor_dialog(editable)
+                return False
+
+            self.run_task_async(lambda log: load_boot_entries(log=log),
+                                error_msg="فشل قراءة إدخالات التمهيد.",
+                                callback=_callback)
+
+        def _run_cmdline_editor_dialog(self, entries):
             dialog = Gtk.Dialog(
-                title="تعيين إدخال التمهيد الافتراضي",
+                title="تحرير معاملات النواة",
                 parent=self,
                 modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-                destroy_with_parent=True # Add this for better dialog management
+                destroy_with_parent=True
             )
-            dialog.set_default_size(400, 300)
-            
-            label = Gtk.Label(label="الرجاء اختيار فهرس إدخال التمهيد الافتراضي:")
-            dialog.get_content_area().pack_start(label, False, False, 5)
-
-            liststore = Gtk.ListStore(str, str) # Index, Title
-            for index, title in entries:
-                liststore.append([index, title])
-            
+            dialog.set_default_size(900, 600)
+            content_area = dialog.get_content_area()
+
+            # Merged view: every argument and how many entries use it
+            merged = merged_cmdline_args(entries)
+            merged_label = Gtk.Label(xalign=0)
+            merged_label.set_line_wrap(True)
+            merged_label.set_selectable(True)
+            merged_label.set_text("المعاملات الحالية (عدد الإدخالات):\n" +
+                                  "  ".join(f"{arg} ({count}/{len(entries)})" for arg, count in merged))
+            content_area.pack_start(merged_label, False, False, 5)
+
+            # Entries to edit: toggle, title, current options
+            liststore = Gtk.ListStore(bool, str, str)
+            for entry in entries:
+                liststore.append([True, entry.title, " ".join(entry.args)])
             treeview = Gtk.TreeView(model=liststore)
-            renderer_index = Gtk.CellRendererText()
-            treeview.append_column(Gtk.TreeViewColumn("الفهرس", renderer_index, text=0))
-            renderer_title = Gtk.CellRendererText()
-            treeview.append_column(Gtk.TreeViewColumn("العنوان", renderer_title, text=1))
-            
+            toggle = Gtk.CellRendererToggle()
+            toggle.connect("toggled", lambda r, path: liststore.set_value(liststore.get_iter(path), 0,
+                                                                            not liststore[path][0]))
+            treeview.append_column(Gtk.TreeViewColumn("تطبيق", toggle, active=0))
+            treeview.append_column(Gtk.TreeViewColumn("الإدخال", Gtk.CellRendererText(), text=1))
+            treeview.append_column(Gtk.TreeViewColumn("المعاملات", Gtk.CellRendererText(), text=2))
             scrollable = Gtk.ScrolledWindow()
             scrollable.set_vexpand(True)
             scrollable.add(treeview)
-            dialog.get_content_area().pack_start(scrollable, True, True, 5)
-            
-            # Add buttons using add_buttons method
-            dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
-            
+            content_area.pack_start(scrollable, True, True, 5)
+
+            grid = Gtk.Grid(column_spacing=10, row_spacing=5)
+            add_entry = Gtk.Entry(hexpand=True, placeholder_text="مثال: mitigations=off nowatchdog")
+            remove_entry = Gtk.Entry(hexpand=True, placeholder_text="مثال: rhgb quiet")
+            grid.attach(Gtk.Label(label="إضافة معاملات:", xalign=0), 0, 0, 1, 1)
+            grid.attach(add_entry, 1, 0, 1, 1)
+            grid.attach(Gtk.Label(label="إزالة معاملات:", xalign=0), 0, 1, 1, 1)
+            grid.attach(remove_entry, 1, 1, 1, 1)
+            content_area.pack_start(grid, False, False, 5)
+
+            preview_buffer = Gtk.TextBuffer()
+            preview_view = Gtk.TextView(buffer=preview_buffer)
+            preview_view.set_editable(False)
+            preview_view.set_monospace(True)
+            preview_scroll = Gtk.ScrolledWindow()
+            preview_scroll.set_vexpand(True)
+            preview_scroll.add(preview_view)
+            content_area.pack_start(preview_scroll, True, True, 5)
+
+            PREVIEW_RESPONSE = 1
+            dialog.add_buttons("معاينة", PREVIEW_RESPONSE,
+                               Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                               "تطبيق", Gtk.ResponseType.OK)
             dialog.show_all()
-            
-            response = dialog.run()
-            
-            selected_index = -1
-            if response == Gtk.ResponseType.OK:
-                selection = treeview.get_selection()
-                model, treeiter = selection.get_selected()
-                if treeiter:
-                    selected_index = int(model.get_value(treeiter, 0)) # Get index as int
-            
+
+            def _compute_changes():
+                add = split_cmdline(add_entry.get_text())
+                remove = split_cmdline(remove_entry.get_text())
+                changes = [] # (entry, new args)
+                for row, entry in zip(liststore, entries):
+                    if not row[0]:
+                        continue
+                    new_args = edit_cmdline(entry.args, add, remove)
+                    if new_args != entry.args:
+                        changes.append((entry, new_args))
+                return changes
+
+            changes = []
+            while True:
+                response = dialog.run()
+                changes = _compute_changes()
+                if response != PREVIEW_RESPONSE:
+                    break
+                if changes:
+                    preview_buffer.set_text("\n\n".join(f"{entry.title}\n- {' '.join(entry.args)}\n+ {' '.join(new_args)}"
+                                                         for entry, new_args in changes))
+                else:
+                    preview_buffer.set_text("لا توجد تغييرات على الإدخالات المحددة.")
             dialog.destroy()
 
-            if selected_index != -1:
-                self.run_command_async(["pkexec", "grubby", "--set-default-index", str(selected_index)],
-                                       error_msg=f"فشل تعيين إدخال التمهيد الافتراضي إلى الفهرس {selected_index}.",
-                                       show_output=False,
-                                       use_shell=False,
-                                       callback=lambda s, o: self.show_info(f"تم تعيين إدخال التمهيد الافتراضي بنجاح إلى الفهرس {selected_index}. أعد تشغيل النظام لتطبيق التغييرات."))
-            else:
-                self.show_info("لم يتم اختيار فهرس.")
-
-        self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
-                               show_output=True,
-                               error_msg="فشل الحصول على إدخالات التمهيد لتعيين الافتراضي.",
-                               use_shell=False,
-                               callback=_get_entries_callback)
-
-    def show_system_info(self, widget):
-        """Displays basic system information."""
-        def _callback(success, output):
-            if not success or not output:
-                self.show_info("تعذر الحصول على معلومات النظام.")
+            if response != Gtk.ResponseType.OK:
+                return
+            if not changes:
+                self.show_info("لا توجد تغييرات لتطبيقها.")
                 return
 
-            info_lines = output.splitlines()
-            display_info = []
-            
-            # --- OS Release ---
-            os_release_path = "/etc/os-release"
-            if os.path.exists(os_release_path):
-                try:
-                    with open(os_release_path, 'r') as f:
-                        os_lines = f.readlines()
-                        for line in os_lines:
-                            if line.startswith("PRETTY_NAME="):
-                                display_info.append(line.replace("PRETTY_NAME=", "إصدار نظام التشغيل: ").strip().strip('"'))
-                                break
-                except Exception as e:
-                    GLib.idle_add(self.log_terminal, f"Error reading {os_release_path}: {e}\n")
-
-            # --- CPU ---
-            cpu_model = ""
-            for line in info_lines:
-                if "Model name:" in line:
-                    cpu_model = line.replace("Model name:", "المعالج:").strip()
-                    display_info.append(cpu_model)
-                    break
-            
-            # --- Architecture ---
-            arch = ""
-            for line in info_lines:
-                if "Architecture:" in line:
-                    arch = line.replace("Architecture:", "البنية:").strip()
-                    display_info.append(arch)
-                    break
+            for entry, new_args in changes:
+                entry.set_args(new_args)
+
+            # Like 'grubby --update-kernel=ALL', an edit of every entry also changes the default command
+            # line, so kernels installed later and grub2-mkconfig --update-bls-cmdline keep it
+            all_selected = all(row[0] for row in liststore)
+            defaults = []
+            if all_selected:
+                defaults = default_cmdline_payload(split_cmdline(add_entry.get_text()), split_cmdline(remove_entry.get_text()))
+            message = f"تم تحديث معاملات النواة في {len(changes)} إدخال تمهيد. أعد تشغيل النظام لتطبيق التغييرات."
+            if defaults:
+                message += "\n\nتم تحديث سطر الأوامر الافتراضي أيضًا: " + "، ".join(item["path"] for item in defaults)
+            elif not all_selected:
+                message += "\n\nتم تعديل الإدخالات المحددة فقط؛ الأنوية المثبتة لاحقًا تستخدم سطر الأوامر الافتراضي دون تغيير."
+
+            def _callback(success, output):
+                get_config(GRUB_DEFAULTS_PATH).discard() # Re-read what is now on disk
+                if success:
+                    GLib.idle_add(self.show_info, message)
+
+            # All entry files (and the defaults) are rewritten by one privileged process (temp file + rename each)
+            self.run_command_async(privileged_apply_files_cmd(),
+                                   error_msg="فشل تحديث معاملات النواة.",
+                                   input_data=boot_entries_payload([entry for entry, _ in changes], defaults),
+                                   callback=_callback)
+
+        def show_grub_boot_entries(self, widget):
+            """Displays a list of GRUB boot entry titles."""
+            def _callback(success, output):
+                if not success or not output:
+                    self.show_info("تعذر الحصول على إدخالات التمهيد أو لا يوجد مخرج. يرجى التحقق من سجل الطرفية لمزيد من التفاصيل.")
+                    return
+
+                titles = []
+                for line in output.splitlines():
+                    if line.startswith("title="):
+                        titles.append(line.replace("title=", "").strip())
+
+                if titles:
+                    self.show_info("إدخالات التمهيد (Grub Entries):\n" + "\n".join(titles))
+                else:
+                    self.show_info("لم يتم العثور على إدخالات تمهيد في مخرجات Grub.")
+                self.update_status_indicator("success", "تم عرض إدخالات التمهيد.")
+
+            self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
+                                   show_output=True,
+                                   error_msg="فشل عرض إدخالات التمهيد. قد تحتاج إلى صلاحيات الجذر.",
+                                   use_shell=False,
+                                   callback=_callback)
+
+        def set_default_boot_entry_by_index(self, widget):
+            """Allows user to set a default GRUB boot entry by index."""
+            def _get_entries_callback(success, output):
+                if not success or not output:
+                    self.show_error("تعذر الحصول على إدخالات التمهيد لتعيين الافتراضي.")
+                    return
+
+                entries = [] # Stores (index, title)
+                current_index = -1
+                current_title = ""
+
+                for line in output.splitlines():
+                    if line.startswith("index="):
+                        # If we processed a previous entry, add it to list
+                        if current_title:
+                            entries.append((str(current_index), current_title))
+                        current_index = int(line.replace("index=", "").strip())
+                        current_title = "" # Reset title for new entry
+                    elif line.startswith("title="):
+                        current_title = line.replace("title=", "").strip()
+
+                # Add the last entry after loop finishes
+                if current_title:
+                    entries.append((str(current_index), current_title))
+
+
+                if not entries:
+                    self.show_info("لا توجد إدخالات تمهيد متاحة لتعيينها كافتراضي.")
+                    return
+
+                # Create a dialog to select the index
+                # Using keyword arguments for Gtk.Dialog constructor and add_buttons method
+                dialog = Gtk.Dialog(
+                    title="تعيين إدخال التمهيد الافتراضي",
+                    parent=self,
+                    modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                    destroy_with_parent=True # Add this for better dialog management
+                )
+                dialog.set_default_size(400, 300)
+
+                label = Gtk.Label(label="الرجاء اختيار فهرس إدخال التمهيد الافتراضي:")
+                dialog.get_content_area().pack_start(label, False, False, 5)
+
+                liststore = Gtk.ListStore(str, str) # Index, Title
+                for index, title in entries:
+                    liststore.append([index, title])
+
+                treeview = Gtk.TreeView(model=liststore)
+                renderer_index = Gtk.CellRendererText()
+                treeview.append_column(Gtk.TreeViewColumn("الفهرس", renderer_index, text=0))
+                renderer_title = Gtk.CellRendererText()
+                treeview.append_column(Gtk.TreeViewColumn("العنوان", renderer_title, text=1))
+
+                scrollable = Gtk.ScrolledWindow()
+                scrollable.set_vexpand(True)
+                scrollable.add(treeview)
+                dialog.get_content_area().pack_start(scrollable, True, True, 5)
+
+                # Add buttons using add_buttons method
+                dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+
+                dialog.show_all()
+
+                response = dialog.run()
+
+                selected_index = -1
+                if response == Gtk.ResponseType.OK:
+                    selection = treeview.get_selection()
+                    model, treeiter = selection.get_selected()
+                    if treeiter:
+                        selected_index = int(model.get_value(treeiter, 0)) # Get index as int
+
+                dialog.destroy()
+
+                if selected_index != -1:
+                    self.run_command_async(["pkexec", "grubby", "--set-default-index", str(selected_index)],
+                                           error_msg=f"فشل تعيين إدخال التمهيد الافتراضي إلى الفهرس {selected_index}.",
+                                           show_output=False,
+                                           use_shell=False,
+                                           callback=lambda s, o: self.show_info(f"تم تعيين إدخال التمهيد الافتراضي بنجاح إلى الفهرس {selected_index}. أعد تشغيل النظام لتطبيق التغييرات."))
+                else:
+                    self.show_info("لم يتم اختيار فهرس.")
+
+            self.run_command_async(["pkexec", "grubby", "--info", "ALL"],
+                                   show_output=True,
+                                   error_msg="فشل الحصول على إدخالات التمهيد لتعيين الافتراضي.",
+                                   use_shell=False,
+                                   callback=_get_entries_callback)
+
+        def show_system_info(self, widget):
+            """Displays basic system information."""
+            def _callback(success, output):
+                if not success or not output:
+                    self.show_info("تعذر الحصول على معلومات النظام.")
+                    return
+
+                info_lines = output.splitlines()
+                display_info = []
+
+                # --- OS Release ---
+                os_release_path = "/etc/os-release"
+                if os.path.exists(os_release_path):
+                    try:
+                        with open(os_release_path, 'r') as f:
+                            os_lines = f.readlines()
+                            for line in os_lines:
+                                if line.startswith("PRETTY_NAME="):
+                                    display_info.append(line.replace("PRETTY_NAME=", "إصدار نظام التشغيل: ").strip().strip('"'))
+                                    break
+                    except Exception as e:
+                        GLib.idle_add(self.log_terminal, f"Error reading {os_release_path}: {e}\n")
+
+                # --- CPU ---
+                cpu_model = ""
+                for line in info_lines:
+                    if "Model name:" in line:
+                        cpu_model = line.replace("Model name:", "المعالج:").strip()
+                        display_info.append(cpu_model)
+                        break
 
-            # --- RAM ---
-            # Try to get RAM from 'free -b'
-            ram_info = ""
-            for line in info_lines:
-                if "Mem:" in line: # free -b output line
-                    parts = line.split()
-                    if len(parts) > 1:
-                        total_mem_bytes = int(parts[1])
-                        # Convert bytes to GiB for readability
-                        total_mem_gib = round(total_mem_bytes / (1024**3), 2)
-                        ram_info = f"الذاكرة الكلية (RAM): {total_mem_gib} GiB"
-                        display_info.append(ram_info)
+                # --- Architecture ---
+                arch = ""
+                for line in info_lines:
+                    if "Architecture:" in line:
+                        arch = line.replace("Architecture:", "البنية:").strip()
+                        display_info.append(arch)
                         break
 
-            # Fallback if specific lines weren't found or raw output is better
-            if not display_info:
-                display_info = info_lines
-
-            self.show_info("معلومات النظام:\n" + "\n".join(display_info))
-            self.update_status_indicator("success", "تم عرض معلومات النظام.")
-
-        # Commands to get system info: /etc/os-release is read directly
-        # lscpu for CPU/architecture, free -b for memory
-        cmd = [
-            "lscpu | grep 'Model name'",
-            "lscpu | grep 'Architecture'",
-            "free -b | grep Mem:"
-        ]
-        # Use shell=True to allow piping and multiple commands in one run
-        self.run_command_async(" ; ".join(cmd),
-                               show_output=True,
-                               error_msg="فشل الحصول على معلومات النظام.",
-                               use_shell=True,
-                               callback=_callback)
-
-    def manage_dnf_settings(self, widget):
-        """Opens a dialog to manage DNF settings like installonly_limit."""
-        config_path = "/etc/dnf/dnf.conf"
-        
-        # Using keyword arguments for Gtk.Dialog constructor and add_buttons method
-        dialog = Gtk.Dialog(
-            title="إعدادات DNF",
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            destroy_with_parent=True
-        )
-        dialog.set_default_size(400, 200)
-        
-        content_area = dialog.get_content_area()
-        
-        # Current installonly_limit
-        current_limit_label = Gtk.Label(label="الحد الحالي للأنوية المثبتة (installonly_limit):")
-        self.current_limit_value_label = Gtk.Label(label="جارٍ التحميل...")
-        
-        hbox_current = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-        hbox_current.pack_start(current_limit_label, False, False, 0)
-        hbox_current.pack_start(self.current_limit_value_label, False, False, 0)
-        content_area.pack_start(hbox_current, False, False, 5)
-
-        # New installonly_limit
-        new_limit_label = Gtk.Label(label="تعيين حد جديد:")
-        self.new_limit_entry = Gtk.Entry()
-        self.new_limit_entry.set_width_chars(5)
-        self.new_limit_entry.set_input_purpose(Gtk.InputPurpose.DIGITS)
-        self.new_limit_entry.set_placeholder_text("3-5") # Typical values
-        
-        hbox_new = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-        hbox_new.pack_start(new_limit_label, False, False, 0)
-        hbox_new.pack_start(self.new_limit_entry, False, False, 0)
-        content_area.pack_start(hbox_new, False, False, 5)
-
-        # Read current limit
-        def _read_limit_callback(success, output):
-            if success and output: # success is True if grep found the line (returncode 0)
+                # --- RAM ---
+                # Try to get RAM from 'free -b'
+                ram_info = ""
+                for line in info_lines:
+                    if "Mem:" in line: # free -b output line
+                        parts = line.split()
+                        if len(parts) > 1:
+                            total_mem_bytes = int(parts[1])
+                            # Convert bytes to GiB for readability
+                            total_mem_gib = round(total_mem_bytes / (1024**3), 2)
+                            ram_info = f"الذاكرة الكلية (RAM): {total_mem_gib} GiB"
+                            display_info.append(ram_info)
+                            break
+
+                # Fallback if specific lines weren't found or raw output is better
+                if not display_info:
+                    display_info = info_lines
+
+                self.show_info("معلومات النظام:\n" + "\n".join(display_info))
+                self.update_status_indicator("success", "تم عرض معلومات النظام.")
+
+            # Commands to get system info: /etc/os-release is read directly
+            # lscpu for CPU/architecture, free -b for memory
+            cmd = [
+                "lscpu | grep 'Model name'",
+                "lscpu | grep 'Architecture'",
+                "free -b | grep Mem:"
+            ]
+            # Use shell=True to allow piping and multiple commands in one run
+            self.run_command_async(" ; ".join(cmd),
+                                   show_output=True,
+                                   error_msg="فشل الحصول على معلومات النظام.",
+                                   use_shell=True,
+                                   callback=_callback)
+
+        def manage_dnf_settings(self, widget):
+            """Opens a dialog to manage DNF and GRUB settings (installonly_limit, GRUB_TIMEOUT...)."""
+            # (file, key, label, default shown when the key is not set, validator)
+            settings = [
+                (DNF_CONF_PATH, "installonly_limit", "الحد الأقصى للأنوية المثبتة (installonly_limit):", "3",
+                 lambda v: v.isdigit() and 1 <= int(v) <= 10),
+                (GRUB_DEFAULTS_PATH, "GRUB_TIMEOUT", "مهلة قائمة Grub بالثواني (GRUB_TIMEOUT):", "5",
+                 lambda v: re.fullmatch(r"-?\d+", v) is not None),
+                (GRUB_DEFAULTS_PATH, "GRUB_DEFAULT", "الإدخال الافتراضي (GRUB_DEFAULT):", "saved",
+                 lambda v: bool(v)),
+                (GRUB_DEFAULTS_PATH, "GRUB_DISABLE_SUBMENU", "تعطيل القائمة الفرعية (GRUB_DISABLE_SUBMENU):", "true",
+                 lambda v: v in ("true", "false")),
+                (GRUB_DEFAULTS_PATH, "GRUB_CMDLINE_LINUX", "معاملات النواة (GRUB_CMDLINE_LINUX):", "",
+                 lambda v: "\n" not in v),
+            ]
+
+            # Both files are world-readable: parse them in-process, no pkexec needed to read
+            configs = {}
+            for path in (DNF_CONF_PATH, GRUB_DEFAULTS_PATH):
                 try:
-                    limit = output.strip().split('=')[-1]
-                    self.current_limit_value_label.set_text(limit)
-                    self.new_limit_entry.set_text(limit)
-                except (IndexError, ValueError):
-                    self.current_limit_value_label.set_text("خطأ في القراءة")
-                    GLib.idle_add(self.log_terminal, f"DEBUG: Failed to parse installonly_limit from: '{output}'\n")
-            else: # success is False if grep didn't find the line (returncode 1) or other issue
-                self.current_limit_value_label.set_text("3 (افتراضي)") # Assume default if not found
-                self.new_limit_entry.set_text("3") # Set default in entry too
-                GLib.idle_add(self.log_terminal, "DEBUG: installonly_limit not found in config or failed to read. Using default '3'.\n")
-            self.update_status_indicator("idle") # Reset status after reading
-
-        # Using grep directly on the file path for current value
-        # pkexec is needed to read /etc/dnf/dnf.conf if permissions are strict
-        self.run_command_async(["pkexec", "grep", "^installonly_limit", config_path],
-                               show_output=True,
-                               error_msg="فشل قراءة installonly_limit من dnf.conf.",
-                               callback=lambda s, o: _read_limit_callback(s, o),
-                               raise_on_error=False) # Important: Don't raise error if grep doesn't find match
-
-        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
-        dialog.show_all()
-        response = dialog.run()
-        
-        if response == Gtk.ResponseType.OK:
-            new_limit_str = self.new_limit_entry.get_text().strip()
-            if new_limit_str.isdigit():
-                new_limit = int(new_limit_str)
-                if 1 <= new_limit <= 10: # Reasonable range for installonly_limit
-                    # Write new limit to dnf.conf
-                    # This command handles both cases: replacing an existing line or appending a new one.
-                    sed_cmd = f"pkexec bash -c \"grep -q '^installonly_limit=' {config_path} && pkexec sed -i '/^installonly_limit=/c\\installonly_limit={new_limit}' {config_path} || pkexec sh -c 'echo \"installonly_limit={new_limit}\" >> {config_path}'\""
-                    
-                    self.run_command_async(sed_cmd,
-                                           error_msg=f"فشل تعيين installonly_limit إلى {new_limit}.",
-                                           use_shell=True,
-                                           callback=lambda s, o: self.show_info(f"تم تعيين installonly_limit إلى {new_limit} بنجاح.") if s else None)
-                else:
-                    self.show_error("الحد الجديد يجب أن يكون رقماً بين 1 و 10.")
-            else:
-                self.show_error("الحد الجديد يجب أن يكون رقماً صحيحاً.")
-        
-        dialog.destroy()
-
-    def create_btrfs_snapshot(self, widget):
-        """Creates a Btrfs snapshot if the root filesystem is Btrfs and snapper is installed."""
-        def _check_btrfs_and_snapper_callback(success, output):
-            if not success:
-                self.show_error("فشل التحقق من نظام الملفات أو snapper. يرجى التحقق من سجل الطرفية.")
+                    configs[path] = get_config(path)
+                except OSError as e:
+                    self.log_terminal(f"Error reading {path}: {e}\n")
+
+            # Using keyword arguments for Gtk.Dialog constructor and add_buttons method
+            dialog = Gtk.Dialog(
+                title="إعدادات DNF و Grub",
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                destroy_with_parent=True
+            )
+            dialog.set_default_size(600, 250)
+
+            grid = Gtk.Grid(column_spacing=10, row_spacing=5)
+            entries = []
+            for row, (path, key, label, default, _validator) in enumerate(settings):
+                config = configs.get(path)
+                value = config.get(key) if config else None
+                entry = Gtk.Entry()
+                entry.set_hexpand(True)
+                entry.set_text(value if value is not None else default)
+                if value is None:
+                    entry.set_placeholder_text(f"{default} (افتراضي)")
+                entry.set_sensitive(config is not None)
+                grid.attach(Gtk.Label(label=label, xalign=0), 0, row, 1, 1)
+                grid.attach(entry, 1, row, 1, 1)
+                entries.append(entry)
+            dialog.get_content_area().pack_start(grid, True, True, 5)
+
+            dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+            dialog.show_all()
+            response = dialog.run()
+            new_values = [entry.get_text().strip() for entry in entries]
+            dialog.destroy()
+
+            if response != Gtk.ResponseType.OK:
                 return
 
-            output_lines = output.splitlines()
-            is_btrfs_root = False
-            snapper_installed = False
-            
-            for line in output_lines:
-                if "btrfs" in line and "/" in line: # Simpler check for btrfs root
-                    is_btrfs_root = True
-                if "snapper" in line and "/usr/bin/snapper" in line: # Check for snapper existence
-                    snapper_installed = True
-
-            if not is_btrfs_root:
-                self.show_info("نظام ملفات الجذر ليس Btrfs. لا يمكن إنشاء لقطة Btrfs.")
+            changed = []
+            for (path, key, label, default, validator), value in zip(settings, new_values):
+                config = configs.get(path)
+                if config is None:
+                    continue
+                if not validator(value):
+                    self.show_error(f"قيمة غير صالحة لـ {key}: '{value}'")
+                    for config in configs.values():
+                        config.discard()
+                    return
+                if config.get(key) is None and value == default:
+                    continue # Leave unset keys at their built-in default
+                if config.set(key, value):
+                    changed.append(f"{key}={value}")
+
+            if not changed:
+                self.show_info("لم يتم تغيير أي إعداد.")
                 return
-            if not snapper_installed:
-                self.show_info("أداة Snapper غير مثبتة. لا يمكن إنشاء لقطة Btrfs.")
+
+            dirty_configs = [c for c in configs.values() if c.dirty]
+            grub_changed = any(c.path == GRUB_DEFAULTS_PATH for c in dirty_configs)
+            cmdline_changed = any(item.startswith("GRUB_CMDLINE_LINUX=") for item in changed)
+
+            def _callback(success, output):
+                for config in dirty_configs:
+                    config.discard() # Re-read what is now on disk
+                if success:
+                    message = "تم حفظ الإعدادات بنجاح:\n" + "\n".join(changed)
+                    if grub_changed:
+                        message += "\n\nأعد توليد ملف grub (توليد grub جديد) لتطبيق إعدادات Grub."
+                    if cmdline_changed:
+                        # grub2-mkconfig leaves the options of BLS entries alone (without --update-bls-cmdline)
+                        message += ("\n\nGRUB_CMDLINE_LINUX يُستخدم للأنوية المثبتة لاحقًا فقط. لتطبيق المعاملات على الأنوية "
+                                    "المثبتة حاليًا استخدم \"🧾 تحرير معاملات النواة\".")
+                    GLib.idle_add(self.show_info, message)
+
+            # One privileged process writes every changed file (temp file + rename per file)
+            self.run_command_async(privileged_apply_files_cmd(),
+                                   error_msg="فشل حفظ الإعدادات.",
+                                   input_data=config_payload(dirty_configs),
+                                   callback=_callback)
+
+        def create_btrfs_snapshot(self, widget):
+            """Creates a Btrfs snapshot if the root filesystem is Btrfs and snapper is installed."""
+            def _check_btrfs_and_snapper_callback(success, output):
+                if not success:
+                    self.show_error("فشل التحقق من نظام الملفات أو snapper. يرجى التحقق من سجل الطرفية.")
+                    return
+
+                output_lines = output.splitlines()
+                is_btrfs_root = False
+                snapper_installed = False
+
+                for line in output_lines:
+                    if "btrfs" in line and "/" in line: # Simpler check for btrfs root
+                        is_btrfs_root = True
+                    if "snapper" in line and "/usr/bin/snapper" in line: # Check for snapper existence
+                        snapper_installed = True
+
+                if not is_btrfs_root:
+                    self.show_info("نظام ملفات الجذر ليس Btrfs. لا يمكن إنشاء لقطة Btrfs.")
+                    return
+                if not snapper_installed:
+                    self.show_info("أداة Snapper غير مثبتة. لا يمكن إنشاء لقطة Btrfs.")
+                    return
+
+                # Proceed to create snapshot
+                # Using keyword arguments for Gtk.MessageDialog constructor
+                dialog = Gtk.MessageDialog(
+                    parent=self,
+                    modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                    message_type=Gtk.MessageType.QUESTION,
+                    buttons=Gtk.ButtonsType.YES_NO,
+                    text="هل تريد إنشاء لقطة Btrfs (snapshot) الآن؟",
+                    secondary_text="سيتم إنشاء لقطة لنظام الجذر. هذا مفيد قبل إجراء تغييرات كبيرة على النواة."
+                )
+                response = dialog.run()
+                dialog.destroy()
+
+                if response == Gtk.ResponseType.YES:
+                    self.run_command_async(["pkexec", "snapper", "--no-dbus", "create", "--description", "Before_Kernel_Operation", "--type", "pre"],
+                                           error_msg="فشل إنشاء لقطة Btrfs.",
+                                           show_output=False,
+                                           use_shell=False,
+                                           callback=lambda s, o: self.show_info("تم إنشاء لقطة Btrfs بنجاح.") if s else None)
+
+            # Check if root is Btrfs and snapper is installed
+            check_cmd = "findmnt -n -o FSTYPE,TARGET / ; which snapper"
+            self.run_command_async(check_cmd,
+                                   show_output=True,
+                                   error_msg="فشل التحقق من بيئة Btrfs/Snapper.",
+                                   use_shell=True,
+                                   callback=_check_btrfs_and_snapper_callback)
+
+        def update_rescue_kernel(self, widget):
+            """
+            Updates the rescue kernel to the current running kernel using kernel-install, unless the
+            existing rescue image is already current. Checks /boot free space before writing anything.
+            """
+            current_kernel_version = os.uname().release
+            vmlinuz_path = f"/lib/modules/{current_kernel_version}/vmlinuz"
+
+            if not os.path.exists(vmlinuz_path):
+                self.show_error(f"مسار vmlinuz للنواة الحالية غير موجود:\n{vmlinuz_path}\nالرجاء التأكد من تثبيت النواة بشكل صحيح.")
                 return
 
-            # Proceed to create snapshot
+            def _plan_callback(success, plan):
+                if not success:
+                    return False
+                if plan["up_to_date"]:
+                    self.show_info(f"نواة rescue محدثة بالفعل للنواة الحالية ({current_kernel_version}). لا حاجة لإعادة البناء.")
+                    return False
+
+                files_to_remove = []
+                if plan["free"] < plan["needed"]:
+                    reclaimable_size = sum(size for _, size in plan["reclaimable"])
+                    if plan["free"] + reclaimable_size < plan["needed"]:
+                        self.show_error(f"المساحة الحرة في /boot غير كافية لبناء نواة rescue.\n"
+                                        f"المطلوب تقريبًا: {format_size(plan['needed'])}\n"
+                                        f"المتاح: {format_size(plan['free'])}\n"
+                                        f"يمكن تحريره من ملفات rescue القديمة: {format_size(reclaimable_size)}")
+                        return False
+                    # Using keyword arguments for Gtk.MessageDialog constructor
+                    dialog = Gtk.MessageDialog(
+                        parent=self,
+                        modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                        message_type=Gtk.MessageType.QUESTION,
+                        buttons=Gtk.ButtonsType.YES_NO,
+                        text="المساحة الحرة في /boot غير كافية. هل تريد حذف ملفات rescue القديمة أولاً؟",
+                        secondary_text=f"المطلوب تقريبًا: {format_size(plan['needed'])}، المتاح: {format_size(plan['free'])}\n\n" +
+                                       "\n".join(f"{path} ({format_size(size)})" for path, size in plan["reclaimable"])
+                    )
+                    response = dialog.run()
+                    dialog.destroy()
+                    if response != Gtk.ResponseType.YES:
+                        return False
+                    files_to_remove = [path for path, _ in plan["reclaimable"]]
+
+                # The current rescue set must go too, or kernel-install keeps it instead of rebuilding
+                files_to_move = plan["rebuild_files"] + [p for p in files_to_remove if p not in plan["rebuild_files"]]
+                if files_to_move:
+                    # Free the space and rebuild in the same privileged call. The old files are moved out
+                    # of /boot first and only deleted once kernel-install succeeded; otherwise they are put back.
+                    cmd = ["pkexec", "sh", "-c", RESCUE_REBUILD_SCRIPT, "sh", current_kernel_version, vmlinuz_path] + files_to_move
+                else:
+                    cmd = ["pkexec", "kernel-install", "add", current_kernel_version, vmlinuz_path]
+                self.run_command_async(cmd,
+                                       error_msg="فشل تحديث نواة rescue.",
+                                       show_output=False,
+                                       use_shell=False,
+                                       callback=lambda s, o: GLib.idle_add(self.show_info, "تم تحديث نواة rescue بنجاح.") if s else None,
+                                       operation="kernel-install add")
+                return False
+
+            self.run_task_async(lambda log: rescue_update_plan(current_kernel_version),
+                                error_msg="فشل فحص ملفات rescue الحالية.",
+                                callback=_plan_callback)
+
+        def show_rescue_files(self, widget):
+            """Lists the rescue files in /boot with the kernel version read from the rescue image."""
+            def _callback(success, sets):
+                if not success:
+                    return False
+                if not sets:
+                    self.show_info("لا توجد ملفات rescue في المسارات المتوقعة.")
+                    return False
+                self._show_table_dialog("ملفات rescue", ["الملف", "إصدار النواة"],
+                                        [(path, r["version"] or "غير معروف") for r in sets for path in rescue_set_files(r)])
+                return False
+
+            self.run_task_async(lambda log: rescue_image_sets(),
+                                error_msg="فشل عرض ملفات rescue.",
+                                callback=_callback)
+
+        def remove_old_rescue(self, widget):
+            """Removes old rescue kernel files from /boot, keeping the current kernel's rescue files."""
             # Using keyword arguments for Gtk.MessageDialog constructor
             dialog = Gtk.MessageDialog(
                 parent=self,
                 modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
                 message_type=Gtk.MessageType.QUESTION,
                 buttons=Gtk.ButtonsType.YES_NO,
-                text="هل تريد إنشاء لقطة Btrfs (snapshot) الآن؟",
-                secondary_text="سيتم إنشاء لقطة لنظام الجذر. هذا مفيد قبل إجراء تغييرات كبيرة على النواة."
+                text="هل تريد إزالة ملفات rescue القديمة؟",
+                secondary_text="سيتم حذف ملفات rescue المرتبطة بالأنوية القديمة فقط. سيتم الاحتفاظ بملفات rescue الخاصة بالنواة الحالية."
             )
             response = dialog.run()
             dialog.destroy()
 
             if response == Gtk.ResponseType.YES:
-                self.run_command_async(["pkexec", "snapper", "--no-dbus", "create", "--description", "Before_Kernel_Operation", "--type", "pre"],
-                                       error_msg="فشل إنشاء لقطة Btrfs.",
-                                       show_output=False,
-                                       use_shell=False,
-                                       callback=lambda s, o: self.show_info("تم إنشاء لقطة Btrfs بنجاح.") if s else None)
-            
-        # Check if root is Btrfs and snapper is installed
-        check_cmd = "findmnt -n -o FSTYPE,TARGET / ; which snapper"
-        self.run_command_async(check_cmd,
-                               show_output=True,
-                               error_msg="فشل التحقق من بيئة Btrfs/Snapper.",
-                               use_shell=True,
-                               callback=_check_btrfs_and_snapper_callback)
-
-    def update_rescue_kernel(self, widget):
-        """Updates the rescue kernel to the current running kernel using kernel-install."""
-        def _get_current_kernel_callback(success, current_kernel_version):
+                # Step 1: Get the current kernel version
+                self.run_command_async(["/usr/bin/uname", "-r"],
+                                       show_output=True,
+                                       error_msg="فشل الحصول على النواة الحالية لتحديد ملفات rescue القديمة.",
+                                       callback=self._process_rescue_removal_with_current_kernel)
+
+        def _process_rescue_removal_with_current_kernel(self, success, current_kernel_version):
+            """Callback to process rescue removal after getting current kernel version."""
             if not success or not current_kernel_version:
-                self.show_error("تعذر الحصول على إصدار النواة الحالي.")
+                GLib.idle_add(self.show_error, "تعذر تحديد النواة الحالية لإزالة ملفات rescue القديمة.")
                 return
 
-            # Ensure current_kernel_version is stripped of any whitespace
-            current_kernel_version = current_kernel_version.strip()
-            vmlinuz_path = f"/lib/modules/{current_kernel_version}/vmlinuz"
-            
-            if not os.path.exists(vmlinuz_path):
-                self.show_error(f"مسار vmlinuz للنواة الحالية غير موجود:\n{vmlinuz_path}\nالرجاء التأكد من تثبيت النواة بشكل صحيح.")
-                return
+            current_kernel_base = current_kernel_version.strip() # Ensure no leading/trailing whitespace
 
-            self.run_command_async(["pkexec", "kernel-install", "add", current_kernel_version, vmlinuz_path],
-                                   error_msg="فشل تحديث نواة rescue.",
-                                   show_output=False,
-                                   use_shell=False,
-                                   callback=lambda s, o: self.show_info("تم تحديث نواة rescue بنجاح.") if s else None)
-
-        self.run_command_async(["/usr/bin/uname", "-r"],
-                               error_msg="فشل الحصول على النواة الحالية لتحديث rescue.",
-                               show_output=True,
-                               use_shell=False,
-                               callback=_get_current_kernel_callback)
-
-    def show_rescue_files(self, widget):
-        # Using 'ls -l' and filtering with grep to show relevant rescue files with details
-        self.run_command_async("ls -l /boot/ | grep -E 'vmlinuz-rescue|initramfs-rescue'",
-                               show_output=True,
-                               error_msg="فشل عرض ملفات rescue.",
-                               use_shell=True, # Use shell for grep pipe
-                               callback=lambda s, f: self.show_info("ملفات rescue:\n" + f) if s and f else self.show_info("لا توجد ملفات rescue في المسارات المتوقعة."))
-
-    def remove_old_rescue(self, widget):
-        """Removes old rescue kernel files from /boot, keeping the current kernel's rescue files."""
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO,
-            text="هل تريد إزالة ملفات rescue القديمة؟",
-            secondary_text="سيتم حذف ملفات rescue المرتبطة بالأنوية القديمة فقط. سيتم الاحتفاظ بملفات rescue الخاصة بالنواة الحالية."
-        )
-        response = dialog.run()
-        dialog.destroy()
-
-        if response == Gtk.ResponseType.YES:
-            # Step 1: Get the current kernel version
-            self.run_command_async(["/usr/bin/uname", "-r"],
-                                   show_output=True,
-                                   error_msg="فشل الحصول على النواة الحالية لتحديد ملفات rescue القديمة.",
-                                   callback=self._process_rescue_removal_with_current_kernel)
+            # Step 2: Group the rescue files and read the real version from each rescue vmlinuz header
+            GLib.idle_add(self.run_task_async, lambda log: rescue_image_sets(),
+                          "فشل عرض ملفات rescue.",
+                          lambda s, sets: self._filter_and_remove_rescue_files(s, sets, current_kernel_base))
 
-    def _process_rescue_removal_with_current_kernel(self, success, current_kernel_version):
-        """Callback to process rescue removal after getting current kernel version."""
-        if not success or not current_kernel_version:
-            self.show_error("تعذر تحديد النواة الحالية لإزالة ملفات rescue القديمة.")
-            return
+        def _filter_and_remove_rescue_files(self, success, rescue_sets, current_kernel_base):
+            """Filters rescue files and prompts for removal."""
+            if not success or not rescue_sets:
+                self.show_info("لا توجد ملفات rescue قابلة للإزالة حاليًا.")
+                return False
 
-        current_kernel_base = current_kernel_version.strip() # Ensure no leading/trailing whitespace
+            # Keep the rescue set built from the current kernel, and this machine's rescue entry
+            old_sets = old_rescue_sets(rescue_sets, current_kernel_base)
+            files_to_remove = [path for r in old_sets for path in rescue_set_files(r)]
 
-        # Step 2: List all rescue files
-        # Using find to get full paths and filter out directories
-        self.run_command_async("find /boot -maxdepth 1 -type f -regex '.*/\\(vmlinuz\\|initramfs\\)-rescue-.*\\(\\.img\\)?' 2>/dev/null",
-                               show_output=True,
-                               use_shell=True,
-                               error_msg="فشل عرض ملفات rescue.",
-                               callback=lambda s, output: self._filter_and_remove_rescue_files(s, output, current_kernel_base))
+            if not files_to_remove:
+                self.show_info("لا توجد ملفات rescue قديمة مرتبطة بأنوية سابقة للحذف.")
+                return False
 
-    def _filter_and_remove_rescue_files(self, success, all_rescue_files_output, current_kernel_base):
-        """Filters rescue files and prompts for removal."""
-        if not success or not all_rescue_files_output:
-            self.show_info("لا توجد ملفات rescue قابلة للإزالة حاليًا.")
-            return
+            warnings = []
+            remaining = [r for r in rescue_sets if r["entry"] and r not in old_sets]
+            if any(r["machine"] for r in old_sets):
+                warnings.append("تحذير: سيتم حذف ملفات rescue الخاصة بهذا الجهاز (0-rescue-<machine-id>) وإدخال التمهيد الخاص بها.")
+            if any(r["entry"] for r in old_sets) and not remaining:
+                warnings.append("تحذير: هذا يحذف إدخال rescue الوحيد؛ لن يبقى أي إدخال rescue في قائمة التمهيد.")
+            elif remaining:
+                warnings.append(f"سيبقى {len(remaining)} إدخال rescue في قائمة التمهيد.")
 
-        all_rescue_files = all_rescue_files_output.splitlines()
-        files_to_remove = []
-
-        for f_path in all_rescue_files:
-            filename = os.path.basename(f_path)
-            version_match = None
-            # Extract version from filename
-            if filename.startswith("vmlinuz-rescue-"):
-                version_match = filename.replace("vmlinuz-rescue-", "")
-            elif filename.startswith("initramfs-rescue-"):
-                version_match = filename.replace("initramfs-rescue-", "").replace(".img", "")
-
-            # If a version is extracted and it's NOT the current kernel's version, add to removal list
-            # Also, ensure we don't remove files that are not clearly associated with a kernel version
-            if version_match and version_match != current_kernel_base:
-                files_to_remove.append(f_path)
-
-        if not files_to_remove:
-            self.show_info("لا توجد ملفات rescue قديمة مرتبطة بأنوية سابقة للحذف.")
-            return
+            # Using keyword arguments for Gtk.MessageDialog constructor
+            confirm_dialog = Gtk.MessageDialog(
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                message_type=Gtk.MessageType.QUESTION,
+                buttons=Gtk.ButtonsType.YES_NO,
+                text="تأكيد حذف الملفات التالية:",
+                secondary_text="\n".join(warnings) + "\n\nسيتم حذف ملفات rescue التالية (مع إدخالات التمهيد الخاصة بها):\n" + "\n".join(files_to_remove)
+            )
+            confirm_response = confirm_dialog.run()
+            confirm_dialog.destroy()
 
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        confirm_dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO,
-            text="تأكيد حذف الملفات التالية:",
-            secondary_text="سيتم حذف ملفات rescue التالية:\n" + "\n".join(files_to_remove)
-        )
-        confirm_response = confirm_dialog.run()
-        confirm_dialog.destroy()
-
-        if confirm_response == Gtk.ResponseType.YES:
-            self.run_command_async(["pkexec", "rm", "-f"] + files_to_remove,
-                                   error_msg="فشل إزالة ملفات rescue القديمة.",
+            if confirm_response == Gtk.ResponseType.YES:
+                self.run_command_async(["pkexec", "rm", "-f"] + files_to_remove,
+                                       error_msg="فشل إزالة ملفات rescue القديمة.",
+                                       show_output=False,
+                                       use_shell=False,
+                                       callback=lambda s, o: GLib.idle_add(self.show_info, "تمت إزالة ملفات rescue القديمة بنجاح.") if s else None)
+            return False
+
+        def show_orphan_kernel_images(self, widget):
+            """Reports /boot/vmlinuz-* images whose header version has no package, no modules or another name."""
+            def _report(log):
+                return kernel_image_report(installed_kernel_versions())
+
+            def _callback(success, rows):
+                if not success:
+                    return False
+                if not rows:
+                    self.show_info("لا توجد صور نواة في /boot.")
+                    return False
+                labels = {
+                    "ok": "سليمة",
+                    "unknown-version": "تعذرت قراءة الإصدار",
+                    "misnamed": "اسم الملف لا يطابق الإصدار",
+                    "no-package": "يتيمة: لا توجد حزمة مثبتة",
+                    "no-modules": "يتيمة: لا يوجد /lib/modules",
+                    "rescue": "rescue",
+                    "rescue-removed-kernel": "rescue لنواة غير مثبتة",
+                }
+                self._show_table_dialog("تقرير صور النواة", ["الملف", "الإصدار (من ترويسة الصورة)", "الحالة"],
+                                        [(path, version, labels.get(status, status)) for path, version, status in rows],
+                                        width=900)
+                return False
+
+            self.run_task_async(_report, error_msg="فشل فحص صور النواة.", callback=_callback)
+
+        def regenerate_grub(self, widget):
+            self.run_command_async(["pkexec", "grub2-mkconfig", "-o", "/boot/grub2/grub.cfg"],
+                                   error_msg="فشل توليد grub جديد.",
                                    show_output=False,
                                    use_shell=False,
-                                   callback=lambda s, o: self.show_info("تمت إزالة ملفات rescue القديمة بنجاح.") if s else None)
-
-    def regenerate_grub(self, widget):
-        self.run_command_async(["pkexec", "grub2-mkconfig", "-o", "/boot/grub2/grub.cfg"],
-                               error_msg="فشل توليد grub جديد.",
-                               show_output=False,
-                               use_shell=False,
-                               callback=lambda s, o: self.show_info("تم توليد grub جديد بنجاح.") if s else None)
-
-    def show_about_dialog(self, widget):
-        """Displays an about dialog for the application."""
-        about_dialog = Gtk.AboutDialog()
-        about_dialog.set_program_name("Fedora Kernel Manager")
-        about_dialog.set_version("1.0")
-        about_dialog.set_copyright("© NaGaR Free Softwares النجار للبرمجيات الحرة 2025") # You can change this
-        about_dialog.set_comments("أداة بسيطة لإدارة نواة Linux في نظام فيدورا.")
-        about_dialog.set_website("https://fb.com/nagasky") # Optional website link
-        about_dialog.set_website_label("الموقع الإلكتروني")
-        about_dialog.set_authors(["Mahmoud Al Nagar محمود النجار"]) # Replace with your name
-        about_dialog.set_license_type(Gtk.License.MIT_X11) # Or Gtk.License.GPL_3_0
-        about_dialog.set_wrap_license(True)
-        
-        about_dialog.run()
-        about_dialog.destroy()
-
-    def show_info(self, message):
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.INFO,
-            buttons=Gtk.ButtonsType.OK,
-            text=message
-        )
-        dialog.run()
-        dialog.destroy()
-
-    def show_error(self, message):
-        # Using keyword arguments for Gtk.MessageDialog constructor
-        dialog = Gtk.MessageDialog(
-            parent=self,
-            modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
-            message_type=Gtk.MessageType.ERROR,
-            buttons=Gtk.ButtonsType.OK,
-            text=message
-        )
-        dialog.run()
-        dialog.destroy()
+                                   callback=lambda s, o: self.show_info("تم توليد grub جديد بنجاح.") if s else None)
+
+        def show_about_dialog(self, widget):
+            """Displays an about dialog for the application."""
+            about_dialog = Gtk.AboutDialog()
+            about_dialog.set_program_name("Fedora Kernel Manager")
+            about_dialog.set_version("1.0")
+            about_dialog.set_copyright("© NaGaR Free Softwares النجار للبرمجيات الحرة 2025") # You can change this
+            about_dialog.set_comments("أداة بسيطة لإدارة نواة Linux في نظام فيدورا.")
+            about_dialog.set_website("https://fb.com/nagasky") # Optional website link
+            about_dialog.set_website_label("الموقع الإلكتروني")
+            about_dialog.set_authors(["Mahmoud Al Nagar محمود النجار"]) # Replace with your name
+            about_dialog.set_license_type(Gtk.License.MIT_X11) # Or Gtk.License.GPL_3_0
+            about_dialog.set_wrap_license(True)
+
+            about_dialog.run()
+            about_dialog.destroy()
+
+        def show_info(self, message):
+            # Using keyword arguments for Gtk.MessageDialog constructor
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                message_type=Gtk.MessageType.INFO,
+                buttons=Gtk.ButtonsType.OK,
+                text=message
+            )
+            dialog.run()
+            dialog.destroy()
+
+        def show_error(self, message):
+            # Using keyword arguments for Gtk.MessageDialog constructor
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                modal=True, # Use modal=True instead of flags=Gtk.DialogFlags.MODAL
+                message_type=Gtk.MessageType.ERROR,
+                buttons=Gtk.ButtonsType.OK,
+                text=message
+            )
+            dialog.run()
+            dialog.destroy()
 
-if __name__ == "__main__":
     win = KernelManager()
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
     Gtk.main()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fedora Kernel Manager")
+    parser.add_argument("--json", action="store_true",
+                        help="print command-line results as JSON instead of a table")
+    parser.add_argument("--boot-history", action="store_true",
+                        help="print boot duration and kernel error counts per boot and per kernel")
+    parser.add_argument("--journal-file", metavar="FILE",
+                        help="read boots from a 'journalctl -o export' (or -o json) file instead of the journal")
+    parser.add_argument("--verify-kernels", nargs="*", metavar="VERSION",
+                        help="verify the files of the kernel packages (all kernels, or the given versions); "
+                             "exits 1 if files are modified or missing, 3 if some could not be read")
+    parser.add_argument("--fleet", choices=sorted(FLEET_OPERATIONS), metavar="OPERATION",
+                        help="run an operation on many hosts: " + ", ".join(sorted(FLEET_OPERATIONS)))
+    parser.add_argument("--host", action="append", default=[], dest="hosts",
+                        help="fleet host (repeatable)")
+    parser.add_argument("--hosts-file", metavar="FILE",
+                        help="file with one fleet host per line ('#' starts a comment)")
+    parser.add_argument("--kernel", metavar="VERSION",
+                        help="kernel version for the set-default fleet operation")
+    parser.add_argument("--parallel", type=int, default=8,
+                        help="number of hosts handled at the same time (default 8)")
+    parser.add_argument("--host-timeout", type=int, default=300, metavar="SECONDS",
+                        help="time limit for the whole operation on one host (default 300)")
+    parser.add_argument("--transport", choices=["ssh", "fake"], default="ssh",
+                        help="how fleet hosts are reached (default ssh)")
+    parser.add_argument("--fake-hosts", metavar="FILE",
+                        help="JSON file describing fake hosts, for --transport fake")
+    parser.add_argument("--no-sudo", action="store_true",
+                        help="do not prefix privileged fleet commands with 'sudo -n' (when logging in as root)")
+    parser.add_argument("--dbus-service", action="store_true",
+                        help="run only the D-Bus service exposing the cached kernel state")
+    parser.add_argument("--system-bus", action="store_true",
+                        help="own the D-Bus name on the system bus (needs a D-Bus policy allowing it)")
+    parser.add_argument("--bus-address", metavar="ADDRESS",
+                        help="connect the D-Bus service to this bus address (e.g. a private dbus-daemon)")
+    parser.add_argument("--refresh-interval", type=int, default=300, metavar="SECONDS",
+                        help="how often the D-Bus service refreshes its state (0 disables, default 300)")
+    parser.add_argument("--textfile-collector", metavar="FILE",
+                        help="periodically write kernel and /boot metrics to this node_exporter .prom file")
+    parser.add_argument("--collector-interval", type=int, default=60, metavar="SECONDS",
+                        help="seconds between two metric writes (default 60)")
+    parser.add_argument("--operation-file", metavar="FILE",
+                        help="last-operation record to report (default: this user's fkm cache)")
+    parser.add_argument("--once", action="store_true",
+                        help="write the metrics file once and exit")
+    parser.add_argument("--apply-files", action="store_true",
+                        help=argparse.SUPPRESS) # Privileged helper: atomically write the files given on stdin
+    parser.add_argument("--initramfs-index", metavar="IMAGE",
+                        help=argparse.SUPPRESS) # Privileged helper: print the entries of a root-only initramfs
+    parser.add_argument("--read-boot-entries", action="store_true",
+                        help=argparse.SUPPRESS) # Privileged helper: print the BLS entries as JSON
+    return parser.parse_args(argv)
+
+
+def cli_boot_history(args):
+    records = collect_boot_history(journal_file=args.journal_file)
+    summary = summarize_boot_history(records)
+    if args.json:
+        print(json.dumps({"boots": records, "kernels": summary}, indent=2))
+        return 0
+    print_table(["BOOT", "KERNEL", "BOOT_S", "ERRORS", "CRITICAL"],
+                [[r["boot_id"], r.get("kernel") or "unknown",
+                  round(r["boot_usec"] / 1e6, 2) if r.get("boot_usec") else None,
+                  r.get("errors"), r.get("critical")] for r in records])
+    print()
+    print_table(["KERNEL", "BOOTS", "AVG_S", "BEST_S", "WORST_S", "AVG_ERRORS"],
+                [[s["kernel"], s["boots"], s["avg_boot_s"], s["best_boot_s"], s["worst_boot_s"], s["avg_errors"]]
+                 for s in summary])
+    return 0
+
+
+def cli_verify_kernels(args):
+    reports = verify_kernels(args.verify_kernels or None,
+                             log=None if args.json else lambda text: print(text, end="", file=sys.stderr))
+    statuses = {r["status"] for r in reports}
+    # 1: modified or missing files; 3: nothing modified, but some files could not be read (run as root)
+    exit_code = 1 if "modified" in statuses else 3 if "incomplete" in statuses else 0
+    if args.json:
+        print(json.dumps({"host": os.uname().nodename, "ok": exit_code == 0, "complete": "incomplete" not in statuses,
+                          "kernels": reports}, indent=2))
+        return exit_code
+    print_table(["KERNEL", "STATUS", "FILES", "MODIFIED", "MISSING", "UNREADABLE", "CACHED"],
+                [[r["version"], r["status"], r["files"],
+                  len(r["modified"]), len(r["missing"]), len(r["unreadable"]), r["cached"]] for r in reports])
+    for report in reports:
+        for path in report["modified"]:
+            print(f"{report['version']}: modified {path}")
+        for path in report["missing"]:
+            print(f"{report['version']}: missing {path}")
+        for path in report["unreadable"]:
+            print(f"{report['version']}: unreadable {path}")
+    if exit_code == 3:
+        print("Some files could not be read and were not verified; run as root for a complete check.", file=sys.stderr)
+    return exit_code
+
+
+def cli_fleet(args):
+    if args.fleet == "set-default" and not args.kernel:
+        print("--fleet set-default needs --kernel VERSION", file=sys.stderr)
+        return 2
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        with open(args.hosts_file, "r") as f:
+            hosts += [l.split("#", 1)[0].strip() for l in f if l.split("#", 1)[0].strip()]
+
+    if args.transport == "fake":
+        if not args.fake_hosts:
+            print("--transport fake needs --fake-hosts FILE", file=sys.stderr)
+            return 2
+        with open(args.fake_hosts, "r") as f:
+            fake_hosts = json.load(f)
+        hosts = hosts or sorted(fake_hosts)
+        transport_factory = lambda host: FakeHostTransport(host, fake_hosts)
+    else:
+        transport_factory = SSHTransport
+
+    if not hosts:
+        print("No hosts given (use --host or --hosts-file).", file=sys.stderr)
+        return 2
+
+    results = run_fleet(hosts, args.fleet, transport_factory, parallel=args.parallel,
+                        timeout=args.host_timeout, kernel=args.kernel, sudo=not args.no_sudo)
+    if args.json:
+        print(json.dumps({"operation": args.fleet, "hosts": results}, indent=2))
+    else:
+        print_table(["HOST", "STATUS", "SECONDS", "DETAILS"],
+                    [[r["host"], "ok" if r["ok"] else "FAILED", r["seconds"], _fleet_summary(r)] for r in results])
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+def run_dbus_service(args):
+    state = KernelState()
+
+    def _on_ready(service):
+        service.request_refresh()
+        if args.refresh_interval > 0:
+            GLib.timeout_add_seconds(args.refresh_interval, lambda: service.request_refresh() or True)
+
+    start_dbus_service(state, Gio.BusType.SYSTEM if args.system_bus else Gio.BusType.SESSION,
+                       address=args.bus_address, on_ready=_on_ready)
+    GLib.MainLoop().run()
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.apply_files:
+        apply_files(json.load(sys.stdin))
+        sys.exit(0)
+    if args.initramfs_index:
+        for entry in iter_initramfs(args.initramfs_index):
+            print(json.dumps(entry))
+        sys.exit(0)
+    if args.read_boot_entries:
+        print(json.dumps(read_boot_entry_files()))
+        sys.exit(0)
+    if args.boot_history:
+        sys.exit(cli_boot_history(args))
+    if args.fleet:
+        sys.exit(cli_fleet(args))
+    if args.verify_kernels is not None:
+        sys.exit(cli_verify_kernels(args))
+    if args.dbus_service:
+        sys.exit(run_dbus_service(args))
+    if args.textfile_collector:
+        sys.exit(run_textfile_collector(args.textfile_collector, args.collector_interval,
+                                        operation_file=args.operation_file, once=args.once))
+
+    sys.exit(run_gui())
 